@@ -0,0 +1,280 @@
+from flask import Blueprint, jsonify, request, session
+from sqlalchemy import select, insert, update, Text
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Task, Goal, ArchivedTasks
+from utils import get_tasks_page, row_key, archived_in, month_range, PAGE_SIZE, MAX_PAGE_SIZE, SORT_KEYS, TASK_STATUSES
+from bulk import RowValidator
+import archiver
+import listings
+import search
+import task_stats
+import goal_history
+
+# JSON API - list, get, create and update tasks and goals (archived tasks are read-only).
+# Lists and gets read only the requested columns and serialise the row tuples directly, no ORM objects.
+# Authenticated by the login session; exempt from CSRF tokens but only accepts JSON bodies, which a
+# cross-site form cannot send
+api = Blueprint('api', __name__, url_prefix='/api')
+
+SORT_COLUMNS = {'due': 'task_due', 'id': 'task_id', 'status': 'task_status'} # needed to build the next cursor
+GOAL_PROGRESS = tuple(Goal.goal_progress.type.enums)
+
+
+# Raised for a bad request - turned into a JSON error response
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@api.errorhandler(ApiError)
+def api_error(error):
+    return jsonify({'error': error.message}), error.status
+
+
+@api.errorhandler(SQLAlchemyError)
+def database_error(error):
+    db.session.rollback()
+    return jsonify({'error': 'Database error'}), 500
+
+
+@api.before_request
+def require_login():
+    if 'username' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    if request.method in ('POST', 'PATCH') and not request.is_json:
+        return jsonify({'error': 'Request body must be JSON'}), 415
+
+
+# Function to pick the columns to read from ?fields=a,b - by default every column except Text ones
+# (descriptions/targets), which are only read when asked for. The id column is always included
+def selected_columns(model, id_column):
+    columns = {attribute.key: attribute.columns[0] for attribute in model.__mapper__.column_attrs}
+    fields = request.args.get('fields')
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        names = [name for name, column in columns.items() if not isinstance(column.type, Text)]
+    if id_column not in names:
+        names.insert(0, id_column)
+    return [getattr(model, name) for name in names]
+
+
+# Function to turn a row tuple into a JSON object - datetimes as ISO 8601
+def serialise(row, names=None):
+    values = row._asdict()
+    return {key: value.isoformat() if hasattr(value, 'isoformat') else value
+            for key, value in values.items() if names is None or key in names}
+
+
+def request_json():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ApiError('Request body must be a JSON object')
+    return data
+
+
+# Function to list one keyset page of a task table with the overview page filters (and any extra conditions)
+def list_tasks(model, conditions=()):
+    columns = selected_columns(model, 'task_id')
+    names = [column.key for column in columns]
+    sort = request.args.get('sort') if request.args.get('sort') in SORT_KEYS else 'due'
+    for name in {SORT_COLUMNS[sort], row_key(model).key} - set(names): # read for the cursor, left out of the response
+        columns.append(getattr(model, name))
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        raise ApiError('limit must be a number')
+    rows, next_cursor = get_tasks_page(
+        model,
+        cursor=request.args.get('cursor') or None,
+        limit=limit,
+        sort=sort,
+        tag=request.args.get('tag') or None,
+        owner=request.args.get('owner') or None,
+        status=request.args.get('status') or None,
+        columns=columns,
+        conditions=conditions
+    )
+    return jsonify({'items': [serialise(row, names) for row in rows], 'next_cursor': next_cursor})
+
+
+# Function to get one row by id with the requested columns
+def get_row(model, id_column, row_id, *conditions):
+    columns = selected_columns(model, id_column)
+    row = db.session.execute(select(*columns).where(getattr(model, id_column) == row_id, *conditions)).first()
+    if row is None:
+        raise ApiError('Not found', 404)
+    return jsonify(serialise(row))
+
+
+@api.route('/tasks')
+def tasks():
+    return list_tasks(Task)
+
+
+@api.route('/tasks/<int:task_id>')
+def task(task_id):
+    return get_row(Task, 'task_id', task_id)
+
+
+# Creates a task - same fields and validation as the Add Task form (and bulk import)
+@api.route('/tasks', methods=['POST'])
+def create_task():
+    values, errors = RowValidator().validate(request_json())
+    if errors:
+        return jsonify({'error': 'Invalid task', 'fields': errors}), 400
+    task_id = db.session.execute(insert(Task).values(values)).inserted_primary_key[0]
+    task_stats.added([values])
+    db.session.commit()
+    listings.bump(listings.TASKS)
+    search.changed(Task, [task_id])
+    return jsonify({'task_id': task_id}), 201
+
+
+# Updates the description, owner and/or status of a task in one UPDATE - same fields as the Update Task form
+@api.route('/tasks/<int:task_id>', methods=['PATCH'])
+def update_task(task_id):
+    data = request_json()
+    values = {}
+    if 'description' in data:
+        if data['description'] is not None and not isinstance(data['description'], str):
+            raise ApiError('description must be a string or null')
+        values['task_description'] = data['description']
+    if 'owner' in data:
+        if not isinstance(data['owner'], str) or not 1 <= len(data['owner']) <= 255:
+            raise ApiError('owner must be 1 to 255 characters')
+        values['task_owner'] = data['owner']
+    if 'status' in data:
+        if data['status'] not in TASK_STATUSES:
+            raise ApiError(f"status must be one of {', '.join(TASK_STATUSES)}")
+        values['task_status'] = data['status']
+    if not values:
+        raise ApiError('Nothing to update - send description, owner or status')
+    before = task_stats.locked([task_id]) # locks the row until the commit
+    result = db.session.execute(update(Task).where(Task.task_id == task_id).values(values)
+                                .execution_options(synchronize_session=False))
+    if not result.rowcount:
+        db.session.rollback()
+        raise ApiError('Not found', 404)
+    task_stats.updated(before, values)
+    db.session.commit()
+    listings.bump(listings.TASKS)
+    search.changed(Task, [task_id])
+    if values.get('task_status') == 'Completed': # completed tasks move to the archive, as in the app
+        archiver.archive_now()
+    return jsonify({'task_id': task_id})
+
+
+# month=YYYY-MM lists one month of the archive (one partition on MySQL)
+@api.route('/archived-tasks')
+def archived_tasks():
+    month = request.args.get('month') or None
+    if month and month_range(month) is None:
+        raise ApiError('month must be YYYY-MM')
+    return list_tasks(ArchivedTasks, archived_in(month))
+
+
+# Archived rows are looked up by their own a_id - a task id can repeat in the archive
+@api.route('/archived-tasks/<int:a_id>')
+def archived_task(a_id):
+    return get_row(ArchivedTasks, 'a_id', a_id)
+
+
+# Searches task names and descriptions - q is required; tag, owner and status filter as on the overview pages,
+# archived is include (default), exclude or only. Results are best match first
+@api.route('/search')
+def search_tasks():
+    query = request.args.get('q', '').strip()
+    if not search.tokenize(query):
+        raise ApiError(f'q must contain a word of at least {search.MIN_TOKEN} characters')
+    archived = request.args.get('archived', 'include')
+    if archived not in search.ARCHIVED_OPTIONS:
+        raise ApiError(f"archived must be one of {', '.join(search.ARCHIVED_OPTIONS)}")
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        raise ApiError('limit must be a number')
+    results = search.search_tasks(query, tag=request.args.get('tag') or None, owner=request.args.get('owner') or None,
+                                  status=request.args.get('status') or None, archived=archived, limit=limit)
+    items = [{key: value.isoformat() if hasattr(value, 'isoformat') else value for key, value in result.items()}
+             for result in results]
+    return jsonify({'items': items, 'backend': search.backend()})
+
+
+# Task counts for dashboards - per tag, owner and status, read from the summary table
+@api.route('/stats')
+def task_statistics():
+    return jsonify(task_stats.summary())
+
+
+# Lists the logged-in user's goals, like the goals overview
+@api.route('/goals')
+def goals():
+    columns = selected_columns(Goal, 'goal_id')
+    rows = db.session.execute(select(*columns).where(Goal.goal_owner == session['username']).order_by(Goal.goal_id))
+    return jsonify({'items': [serialise(row) for row in rows]})
+
+
+@api.route('/goals/<int:goal_id>')
+def goal(goal_id):
+    return get_row(Goal, 'goal_id', goal_id, Goal.goal_owner == session['username'])
+
+
+# Creates a goal for the logged-in user
+@api.route('/goals', methods=['POST'])
+def create_goal():
+    data = request_json()
+    name = data.get('name')
+    if not isinstance(name, str) or not 1 <= len(name) <= 255:
+        raise ApiError('name must be 1 to 255 characters')
+    values = {'goal_name': name, 'goal_target': data.get('target'), 'goal_owner': session['username']}
+    if data.get('progress') is not None:
+        if data['progress'] not in GOAL_PROGRESS:
+            raise ApiError(f"progress must be one of {', '.join(GOAL_PROGRESS)}")
+        values['goal_progress'] = data['progress']
+    goal_id = db.session.execute(insert(Goal).values(values)).inserted_primary_key[0]
+    if 'goal_progress' in values:
+        goal_history.record(goal_id, session['username'], values['goal_progress'])
+    db.session.commit()
+    listings.bump(listings.goals_listing(session['username']))
+    return jsonify({'goal_id': goal_id}), 201
+
+
+# Updates the progress of one of the logged-in user's goals - same field as the Update Goal form
+@api.route('/goals/<int:goal_id>', methods=['PATCH'])
+def update_goal(goal_id):
+    data = request_json()
+    if data.get('progress') not in GOAL_PROGRESS:
+        raise ApiError(f"progress must be one of {', '.join(GOAL_PROGRESS)}")
+    result = db.session.execute(update(Goal)
+                                .where(Goal.goal_id == goal_id, Goal.goal_owner == session['username'])
+                                .values(goal_progress=data['progress'])
+                                .execution_options(synchronize_session=False))
+    if not result.rowcount:
+        db.session.rollback()
+        raise ApiError('Not found', 404)
+    goal_history.record(goal_id, session['username'], data['progress'])
+    db.session.commit()
+    listings.bump(listings.goals_listing(session['username']))
+    return jsonify({'goal_id': goal_id})
+
+
+# Progress history of the logged-in user's goals - streaks and daily / weekly trends, read from the rollups
+@api.route('/goals/history')
+def goal_progress_summary():
+    return jsonify(goal_history.summary(session['username']))
+
+
+# Logged progress updates of one of the logged-in user's goals, newest first
+@api.route('/goals/<int:goal_id>/history')
+def goal_progress_history(goal_id):
+    owned = db.session.execute(select(Goal.goal_id).where(Goal.goal_id == goal_id, Goal.goal_owner == session['username'])).first()
+    if owned is None:
+        raise ApiError('Not found', 404)
+    entries = goal_history.history(goal_id)
+    return jsonify({'goal_id': goal_id, 'items': [{**entry, 'logged_at': entry['logged_at'].isoformat()} for entry in entries]})
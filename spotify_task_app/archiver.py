@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import select, insert, delete, literal, DateTime
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Task, ArchivedTasks
+import listings
+import search
+import task_stats
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500 # rows moved per transaction
+ARCHIVE_COLUMNS = ('task_id', 'task_name', 'task_description', 'task_owner', 'task_tag', 'task_due', 'task_status')
+
+
+# Running totals for the archiver, reported by the CLI command and the metrics endpoint
+class ArchiverStats:
+    def __init__(self):
+        self.runs = 0
+        self.rows = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.last_run = None # result of the most recent run
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        with self._lock:
+            self.runs += 1
+            self.rows += result['rows']
+            self.batches += result['batches']
+            self.seconds += result['seconds']
+            self.last_run = result
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def as_dict(self):
+        return {
+            'runs': self.runs,
+            'rows': self.rows,
+            'batches': self.batches,
+            'seconds': self.seconds,
+            'rows_per_sec': self.rows / self.seconds if self.seconds else 0.0,
+            'errors': self.errors,
+            'last_run': self.last_run
+        }
+
+
+stats = ArchiverStats()
+
+
+# Function to move completed tasks from Tasks to ArchivedTasks.
+# Works in batches of batch_size rows, each copied and deleted in its own short transaction, and
+# only ever reads rows that are completed right now (status index), never the whole archive.
+# Rows locked by another archiver (other worker process) are skipped rather than waited on
+def archive_completed(batch_size=BATCH_SIZE, max_batches=None):
+    tasks = Task.__table__
+    archive_columns = [tasks.c[name] for name in ARCHIVE_COLUMNS]
+    started = time.perf_counter()
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        task_ids = db.session.execute(
+            select(tasks.c.task_id)
+            .where(tasks.c.task_status == 'Completed')
+            .order_by(tasks.c.task_id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not task_ids:
+            break
+        task_stats.archived(task_ids)
+        archived_at = literal(datetime.now(), DateTime) # decides the archive month (partition)
+        db.session.execute(insert(ArchivedTasks.__table__).from_select(
+            ARCHIVE_COLUMNS + ('archived_at',), select(*archive_columns, archived_at).where(tasks.c.task_id.in_(task_ids))))
+        db.session.execute(delete(tasks).where(tasks.c.task_id.in_(task_ids)))
+        db.session.commit()
+        listings.bump(listings.TASKS, listings.ARCHIVE) # per batch, so pages never show a row in both places
+        search.changed(Task, task_ids)
+        search.changed(ArchivedTasks) # new rows only
+        moved += len(task_ids)
+        batches += 1
+        if len(task_ids) < batch_size: # nothing left
+            break
+    seconds = time.perf_counter() - started
+    result = {'rows': moved, 'batches': batches, 'seconds': seconds, 'rows_per_sec': moved / seconds if seconds else 0.0}
+    stats.record(result)
+    if moved:
+        logger.info('Archived %d tasks in %d batches (%.0f rows/s)', moved, batches, result['rows_per_sec'])
+    return result
+
+
+# Function to move completed tasks to the archive straight away (one batch) after a task is completed -
+# a failure here is left to the scheduled run
+def archive_now():
+    try:
+        archive_completed(max_batches=1)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        stats.record_error()
+        logger.error('Archiving failed: %s', e)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+# Function to start the scheduled archiver once per process - a daemon thread that runs
+# archive_completed every interval seconds inside an app context
+def start(app, interval, batch_size=BATCH_SIZE):
+    global _worker
+    if _worker is not None: # already running - checked on every request, so kept lock-free
+        return
+    with _worker_lock:
+        if _worker is not None or not interval:
+            return
+        def run():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        archive_completed(batch_size)
+                    except SQLAlchemyError as e:
+                        db.session.rollback()
+                        stats.record_error()
+                        logger.error('Archiver run failed: %s', e)
+                    finally:
+                        db.session.remove()
+        _worker = threading.Thread(target=run, name='archiver', daemon=True)
+        _worker.start()
@@ -0,0 +1,91 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for the parts of the Spotify Web API the app calls - playlists and artist albums.
+# Every request waits latency seconds (plus up to jitter) before answering, like a real round trip,
+# and is counted so the benchmark can report upstream calls per route
+
+PLAYLIST_PATH = re.compile(r'^/v1/playlists/([^/]+)$')
+ALBUMS_PATH = re.compile(r'^/v1/artists/([^/]+)/albums$')
+
+
+class FakeSpotify:
+    def __init__(self, latency=0.05, jitter=0.0, albums_per_artist=30, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.albums_per_artist = albums_per_artist
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/v1/'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-spotify', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+    def _wait(self):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def playlist(self, playlist_id):
+        return {'name': f'Playlist {playlist_id}', 'external_urls': {'spotify': f'https://open.spotify.com/playlist/{playlist_id}'}}
+
+    def albums(self, artist_id, limit, offset):
+        total = self.albums_per_artist
+        items = [{'name': f'Album {number}', 'external_urls': {'spotify': f'https://open.spotify.com/album/{artist_id}{number}'}}
+                 for number in range(offset, min(offset + limit, total))]
+        has_next = offset + limit < total
+        return {'items': items, 'total': total, 'limit': limit, 'offset': offset,
+                'next': f'{self.url}artists/{artist_id}/albums?offset={offset + limit}&limit={limit}' if has_next else None}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._count()
+                fake._wait()
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                playlist = PLAYLIST_PATH.match(url.path)
+                albums = ALBUMS_PATH.match(url.path)
+                if playlist:
+                    self._send(200, fake.playlist(playlist.group(1)))
+                elif albums:
+                    limit = int(query.get('limit', ['20'])[0])
+                    offset = int(query.get('offset', ['0'])[0])
+                    self._send(200, fake.albums(albums.group(1), limit, offset))
+                else:
+                    self._send(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args): # keep benchmark output clean
+                pass
+
+        return Handler
@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+# Route-level benchmark - runs every route of app.py against a seeded SQLite database and a local
+# fake Spotify server, and reports latency percentiles, SQL statements and Spotify calls per request.
+#
+#   python benchmarks/run.py                          # defaults, results saved to benchmarks/results/
+#   python benchmarks/run.py --latency 0.2 --cold     # slow Spotify, caches cleared before every request
+#   python benchmarks/run.py --snapshot               # category pages served from a catalog snapshot
+#   python benchmarks/run.py --compare benchmarks/results/baseline.json
+#
+# Needs no MySQL, Redis or Spotify account.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+CATEGORIES = ('cleaning', 'cooking', 'gardening', 'shopping', 'laundry', 'diy', 'finance', 'home', 'pets', 'childcare')
+TAGS = ('cleaning', 'cooking', 'shopping', 'gardening', 'laundry', 'DIY', 'finance', 'home', 'pets', 'childcare')
+STATUSES = ('New', 'In Progress', 'Completed')
+ARCHIVE_MONTH = '2024-08' # a month of the seeded archive
+USERNAME = 'bench'
+PASSWORD = 'bench-password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark every route of the app')
+    parser.add_argument('--iterations', type=int, default=30, help='Measured requests per route')
+    parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests per route first')
+    parser.add_argument('--tasks', type=int, default=2000, help='Tasks seeded into the database')
+    parser.add_argument('--archived', type=int, default=2000, help='Archived tasks seeded into the database')
+    parser.add_argument('--goals', type=int, default=50, help='Goals seeded for the benchmark user')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the fake Spotify takes per call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random seconds (0..jitter) per Spotify call')
+    parser.add_argument('--cold', action='store_true', help='Clear the Spotify and listing caches before every request')
+    parser.add_argument('--snapshot', action='store_true', help='Serve the category pages from a catalog snapshot (CATALOG_SNAPSHOT)')
+    parser.add_argument('--routes', help='Comma separated route names to run (default: all)')
+    parser.add_argument('--output', help='Where to save results (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    return parser.parse_args()
+
+
+# One benchmarked request - path and form/JSON data can depend on the iteration number
+class Route:
+    def __init__(self, name, path, method='GET', data=None, json=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.data = data
+        self.json = json
+
+    def request(self, iteration):
+        resolve = lambda value: value(iteration) if callable(value) else value
+        return {'path': resolve(self.path), 'method': self.method, 'data': resolve(self.data), 'json': resolve(self.json)}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Function to fill the database - bulk inserts, so seeding stays fast for large sizes
+def seed(manager, args):
+    from sqlalchemy import insert
+    from utils import create_user
+    db, Task, ArchivedTasks, Goal = manager.db, manager.Task, manager.ArchivedTasks, manager.Goal
+    db.create_all()
+    create_user('Bench User', USERNAME, PASSWORD)
+    start = datetime(2024, 9, 1, 9, 0)
+    owners = ('Alex', 'Sam', USERNAME, None)
+    db.session.execute(insert(Task), [{
+        'task_name': f'Task {number}', 'task_description': 'Seeded task ' * 10, 'task_owner': owners[number % len(owners)],
+        'task_tag': TAGS[number % len(TAGS)], 'task_due': start + timedelta(hours=number), 'task_status': STATUSES[number % 2] # no Completed
+    } for number in range(args.tasks)])
+    if args.archived:
+        db.session.execute(insert(ArchivedTasks), [{
+            'task_id': args.tasks + number + 1, 'task_name': f'Archived {number}', 'task_owner': owners[number % len(owners)],
+            'task_tag': TAGS[number % len(TAGS)], 'task_due': start - timedelta(hours=number), 'task_status': 'Completed',
+            'archived_at': start - timedelta(hours=number) # archived as they fell due - several archive months
+        } for number in range(args.archived)])
+    db.session.execute(insert(Goal), [{'goal_name': f'Goal {number}', 'goal_target': 'Every day', 'goal_owner': USERNAME}
+                                      for number in range(args.goals)])
+    # tasks for the claim routes - one unowned task per claim request
+    claims = args.warmup + args.iterations
+    db.session.execute(insert(Task), [{'task_name': f'Claimable {number}', 'task_tag': 'home', 'task_status': 'New',
+                                       'task_due': start} for number in range(claims * 11)])
+    db.session.commit()
+    claimable = [task_id for (task_id,) in db.session.execute(
+        db.select(Task.task_id).where(Task.task_name.like('Claimable %')).order_by(Task.task_id))]
+    return {
+        'task_id': db.session.execute(db.select(Task.task_id).where(Task.task_owner == 'Alex').limit(1)).scalar(),
+        'goal_id': db.session.execute(db.select(Goal.goal_id).limit(1)).scalar(),
+        'claim': claimable[:claims],
+        'bulk_claim': claimable[claims:]
+    }
+
+
+def build_routes(ids):
+    new_task = lambda i: {'name': f'Bench Task {i}', 'description': 'Added by the benchmark', 'owner': USERNAME,
+                          'tag': 'cooking', 'due': '2024-10-01T18:30', 'status': 'New'}
+    routes = [
+        Route('login', '/', 'POST', data={'username': USERNAME, 'password': PASSWORD}),
+        Route('signup', '/signup', 'POST', data=lambda i: {'username': f'signup-{i}', 'name': 'Signup', 'password': PASSWORD}),
+        Route('app-home', '/app'),
+        Route('overview-tasks', '/overview-tasks'),
+        Route('overview-tasks-filtered', '/overview-tasks?tag=cooking&sort=status&limit=50'),
+        Route('overview-tasks-all', '/overview-tasks?all=1'),
+        Route('overview-goals', '/overview-goals'),
+        Route('archived-tasks', '/archived-tasks'),
+        Route('archived-tasks-month', f"/archived-tasks?month={ARCHIVE_MONTH}"),
+        Route('search-tasks', '/search-tasks?q=seeded+task'),
+        Route('dashboard', '/dashboard'),
+        Route('goal-history', f"/goal-history?goal_id={ids['goal_id']}"),
+        Route('add-task', '/add-task', 'POST', data=new_task),
+        Route('update-task', f"/update-task/{ids['task_id']}", 'POST',
+              data=lambda i: {'description': f'Updated {i}', 'owner': 'Alex', 'status': 'In Progress'}),
+        Route('claim-task', lambda i: f"/claim-task/{ids['claim'][i]}", 'POST'),
+        Route('claim-tasks', '/claim-tasks', 'POST', data=lambda i: {'task_id': ids['bulk_claim'][i * 10:(i + 1) * 10]}),
+        Route('add-goal', '/add-goal', 'POST', data=lambda i: {'name': f'Bench Goal {i}', 'target': 'Weekly', 'owner': USERNAME}),
+        Route('update-goal', f"/update-goal/{ids['goal_id']}", 'POST', data={'progress': 'Attempted'}),
+        Route('export-tasks', '/export-tasks?format=csv'),
+        Route('api-tasks', '/api/tasks?fields=task_name,task_due,task_status'),
+        Route('api-create-task', '/api/tasks', 'POST', json=new_task),
+        Route('metrics', '/metrics'),
+        Route('pool-stats', '/pool-stats'),
+        Route('spotify', '/spotify'),
+        Route('home-page', '/home_page'),
+    ]
+    routes.extend(Route(f'category-{category}', f'/home_page/{category}') for category in CATEGORIES)
+    return routes
+
+
+def run(manager, client, fake, routes, args):
+    import listings
+    from sqlalchemy import event
+    statements = Counter()
+    event.listen(manager.db.engine, 'before_cursor_execute', lambda *_: statements.update(['sql']))
+    results = {}
+    for route in routes:
+        samples, sql, upstream, status_codes = [], [], [], Counter()
+        for iteration in range(args.warmup + args.iterations):
+            if args.cold:
+                manager.catalog_cache.clear()
+                manager.category_pages.invalidate()
+                listings.pages.clear()
+            request = route.request(iteration)
+            statements.clear()
+            calls_before = fake.calls
+            started = time.perf_counter()
+            response = client.open(request['path'], method=request['method'], data=request['data'], json=request['json'])
+            response.get_data() # streamed pages are only complete once read
+            elapsed = time.perf_counter() - started
+            if iteration < args.warmup:
+                continue
+            samples.append(elapsed)
+            sql.append(statements['sql'])
+            upstream.append(fake.calls - calls_before)
+            status_codes[str(response.status_code)] += 1
+        results[route.name] = {
+            'requests': len(samples),
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p90_ms': percentile(samples, 0.90) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'mean_ms': sum(samples) / len(samples) * 1000,
+            'max_ms': max(samples) * 1000,
+            'sql_per_request': sum(sql) / len(sql),
+            'upstream_per_request': sum(upstream) / len(upstream),
+            'status_codes': dict(status_codes)
+        }
+        print(format_row(route.name, results[route.name]), flush=True)
+    return results
+
+
+HEADER = f"{'route':<26}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'sql/req':>9}{'spotify/req':>13}  status"
+
+
+def format_row(name, result):
+    return (f"{name:<26}{result['p50_ms']:>9.2f}{result['p90_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['max_ms']:>9.2f}"
+            f"{result['sql_per_request']:>9.1f}{result['upstream_per_request']:>13.2f}  "
+            + ' '.join(f'{code}x{count}' for code, count in sorted(result['status_codes'].items())))
+
+
+# Function to print how p50/p90 moved against an earlier run - positive is slower
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)['routes']
+    print(f"\nCompared with {baseline_path}")
+    print(f"{'route':<26}{'p50 change':>12}{'p90 change':>12}{'sql/req':>14}")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = lambda key: (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        print(f"{name:<26}{change('p50_ms'):>+11.1f}%{change('p90_ms'):>+11.1f}%"
+              f"{before['sql_per_request']:>7.1f} ->{result['sql_per_request']:>4.1f}")
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='manager-bench-')
+    # configuration the app reads at import time
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(workdir, "bench.db")}'
+    os.environ.setdefault('CLIENT_ID', 'benchmark')
+    os.environ.setdefault('CLIENT_SECRET', 'benchmark')
+    os.environ.pop('CACHE_REDIS_URL', None) # in-process caches, so --cold can clear them
+    sys.path.insert(0, APP_DIR)
+    from fake_spotify import FakeSpotify
+    import app as manager
+
+    fake = FakeSpotify(latency=args.latency, jitter=args.jitter).start()
+    manager.sp.prefix = fake.url # spotipy sends every call to the fake server
+    background = manager.metrics.TimedSpotify(auth='benchmark') # no client credentials flow against the fake
+    background.prefix = fake.url
+    manager.catalog.background_client = background
+    manager.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False) # TESTING also keeps the background archiver off
+    if args.snapshot: # resolved once through the fake, then served from the file
+        import snapshot
+        data, _ = snapshot.build(manager.Catalog(background))
+        snapshot.write(os.path.join(workdir, 'catalog.json'), data)
+        manager.catalog.snapshot = snapshot.Snapshot(os.path.join(workdir, 'catalog.json'))
+
+    with manager.app.app_context():
+        ids = seed(manager, args)
+        routes = build_routes(ids)
+        if args.routes:
+            wanted = set(args.routes.split(','))
+            routes = [route for route in routes if route.name in wanted]
+        client = manager.app.test_client()
+        with client.session_transaction() as session:
+            session['username'] = USERNAME
+            session['token_info'] = {'access_token': 'benchmark', 'token_type': 'Bearer', 'refresh_token': 'benchmark',
+                                     'scope': manager.sp_oauth.scope, 'expires_in': 3600,
+                                     'expires_at': int(time.time()) + 24 * 3600}
+        print(HEADER)
+        results = run(manager, client, fake, routes, args)
+    fake.stop()
+
+    output = args.output or os.path.join(HERE, 'results', f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump({
+            'meta': {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'options': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+            },
+            'routes': results
+        }, output_file, indent=2)
+    print(f'\nSaved results to {output}')
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import csv
+import io
+import json
+import time
+from werkzeug.datastructures import MultiDict
+from sqlalchemy import insert, select
+from models import db, Task
+from forms import TaskForm
+import listings
+import search
+import task_stats
+
+CHUNK_SIZE = 500 # rows per batched INSERT / transaction
+MAX_REPORTED_ERRORS = 20 # invalid rows listed in the result (all are counted)
+FIELDS = ('name', 'description', 'owner', 'tag', 'due', 'status') # TaskForm field names, also the file columns
+DUE_FORMAT = '%Y-%m-%dT%H:%M' # same format as TaskForm.due
+FORMATS = ('csv', 'jsonl')
+
+
+# Function to guess the file format from its name - JSON lines for .jsonl/.json, CSV otherwise
+def format_for(filename):
+    return 'jsonl' if filename.endswith(('.jsonl', '.json')) else 'csv'
+
+
+# Function to read rows one at a time from a text stream, so files larger than memory can be imported.
+# Yields (line number, row, error) - error describes a line that is not valid JSON, row is then None
+def read_rows(stream, fmt='csv'):
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f'Not valid JSON: {e}'
+            continue
+        yield line_number, row, None
+
+
+# Validates rows with the same rules as the Add Task form. One form instance is reused for
+# every row (process() resets it), which is much cheaper than building a form per row
+class RowValidator:
+    def __init__(self):
+        self.form = TaskForm(formdata=None, meta={'csrf': False})
+
+    # Returns (values for the Tasks table, None) or (None, form errors)
+    def validate(self, row):
+        if not isinstance(row, dict): # e.g. a JSON line holding a list
+            return None, {'row': ['Must be an object of task fields']}
+        formdata = MultiDict({key: str(value) for key, value in row.items() if key in FIELDS and value not in (None, '')})
+        self.form.process(formdata)
+        if not self.form.validate():
+            return None, self.form.errors
+        return {
+            'task_name': self.form.name.data,
+            'task_description': self.form.description.data or None,
+            'task_owner': self.form.owner.data or None,
+            'task_tag': self.form.tag.data,
+            'task_due': self.form.due.data,
+            'task_status': self.form.status.data
+        }, None
+
+
+# Function to import tasks from a CSV or JSON-lines stream.
+# Valid rows are inserted chunk_size at a time as one batched INSERT per transaction; invalid
+# rows are skipped and reported. Returns counts and throughput
+def import_tasks(stream, fmt='csv', chunk_size=CHUNK_SIZE):
+    validator = RowValidator()
+    tasks = Task.__table__
+    started = time.perf_counter()
+    inserted = invalid = 0
+    errors = []
+    chunk = []
+    for line_number, row, error in read_rows(stream, fmt):
+        values, row_errors = (None, {'row': [error]}) if error else validator.validate(row)
+        if row_errors:
+            invalid += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'line': line_number, 'errors': row_errors})
+            continue
+        chunk.append(values)
+        if len(chunk) >= chunk_size:
+            inserted += _insert_chunk(tasks, chunk)
+            chunk = []
+    if chunk:
+        inserted += _insert_chunk(tasks, chunk)
+    seconds = time.perf_counter() - started
+    return {'rows': inserted, 'invalid': invalid, 'errors': errors, 'seconds': seconds,
+            'rows_per_sec': inserted / seconds if seconds else 0.0}
+
+
+def _insert_chunk(table, chunk):
+    try:
+        # executemany with one cached statement - PyMySQL rewrites it into multi-row INSERTs
+        db.session.execute(insert(table), chunk)
+        task_stats.added(chunk)
+        db.session.commit()
+        listings.bump(listings.TASKS)
+        search.changed(Task) # new rows only
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(chunk)
+
+
+# Function to turn a task table into CSV or JSON-lines text, yielding (text, row count) per batch.
+# Only the exported columns are read, through a server-side cursor (yield_per)
+def export_chunks(model=Task, fmt='csv', chunk_size=CHUNK_SIZE):
+    columns = [model.task_id, model.task_name, model.task_description, model.task_owner,
+               model.task_tag, model.task_due, model.task_status]
+    result = db.session.execute(select(*columns).order_by(model.task_id).execution_options(yield_per=chunk_size))
+    header = ('id',) + FIELDS
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(header)
+        yield buffer.getvalue(), 0
+    for rows in result.partitions():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == 'csv' else None
+        for row in rows:
+            values = list(row)
+            values[5] = values[5].strftime(DUE_FORMAT) if values[5] else None # due, re-importable
+            if writer:
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(header, values))) + '\n')
+        yield buffer.getvalue(), len(rows)
+
+
+# Function to export a task table to a text stream. Returns counts and throughput
+def export_tasks(out, model=Task, fmt='csv', chunk_size=CHUNK_SIZE):
+    started = time.perf_counter()
+    exported = 0
+    for text, count in export_chunks(model, fmt, chunk_size):
+        out.write(text)
+        exported += count
+    seconds = time.perf_counter() - started
+    return {'rows': exported, 'seconds': seconds, 'rows_per_sec': exported / seconds if seconds else 0.0}
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# Sentinel returned by backends when a key is absent or expired (None is a valid cached value)
+MISSING = object()
+
+
+# In-process backend - bounded dictionary with per-entry expiry and least recently used eviction
+class MemoryBackend:
+    def __init__(self, max_size=512, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock # injectable for tests
+        self.evictions = 0
+        self._entries = OrderedDict() # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock() # shared by all request threads
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= self.clock():
+                del self._entries[key] # expired entries are dropped lazily
+                return MISSING
+            self._entries.move_to_end(key) # marks as most recently used
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = self.clock() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size: # evicts least recently used
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def incr(self, key, seed=0):
+        with self._lock:
+            entry = self._entries.get(key)
+            value = (entry[1] if entry is not None else seed) + 1
+            self._entries[key] = (None, value) # counters never expire
+            self._entries.move_to_end(key)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared backend - Redis, so every worker process serves the same entries
+# Size bound and eviction are left to the Redis server (maxmemory + allkeys-lru policy)
+class RedisBackend:
+    def __init__(self, client, prefix='manager:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        import redis
+        try:
+            raw = self.client.get(self.prefix + key)
+        except redis.RedisError: # cache outage should never break a page - treated as a miss
+            return MISSING
+        if raw is None:
+            return MISSING
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        import redis
+        try:
+            self.client.set(self.prefix + key, json.dumps(value), ex=ttl or None)
+        except redis.RedisError:
+            pass
+
+    def incr(self, key, seed=0):
+        import redis
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(self.prefix + key, seed, nx=True) # starts a missing counter at seed
+            pipe.incr(self.prefix + key)
+            return pipe.execute()[1]
+        except redis.RedisError:
+            return None
+
+    def delete(self, key):
+        import redis
+        try:
+            self.client.delete(self.prefix + key)
+        except redis.RedisError:
+            pass
+
+    def clear(self):
+        import redis
+        try:
+            for key in self.client.scan_iter(match=self.prefix + '*'):
+                self.client.delete(key)
+        except redis.RedisError:
+            pass
+
+
+# Function to pick a backend - Redis when a URL is configured, in-process otherwise
+def make_backend(redis_url=None, max_size=512, prefix='manager:'):
+    if redis_url:
+        import redis # optional dependency, only needed for the shared backend
+        return RedisBackend(redis.Redis.from_url(redis_url), prefix=prefix)
+    return MemoryBackend(max_size=max_size)
+
+
+# Cache front end - namespaced keys, default TTL and hit/miss counters over any backend
+class Cache:
+    def __init__(self, backend=None, ttl=300, namespace=''):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return f'{self.namespace}:{key}' if self.namespace else key
+
+    def get(self, key):
+        value = self.backend.get(self._key(key))
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self._key(key), value, ttl if ttl is not None else self.ttl)
+
+    # Increments a counter and returns its new value. A counter that is missing (never set,
+    # evicted or lost with a Redis restart) starts again from seed rather than from 0
+    def incr(self, key, seed=0):
+        return self.backend.incr(self._key(key), seed)
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    def clear(self):
+        self.backend.clear()
+
+    # Returns the cached value, or calls loader() once and caches its result
+    def get_or_set(self, key, loader, ttl=None):
+        value = self.get(key)
+        if value is MISSING:
+            value = loader()
+            self.set(key, value, ttl)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'size': len(self.backend) if hasattr(self.backend, '__len__') else None,
+            'evictions': getattr(self.backend, 'evictions', None)
+        }
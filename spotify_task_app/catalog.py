@@ -0,0 +1,238 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from cache import Cache, MISSING
+
+logger = logging.getLogger(__name__)
+
+# The category pages only render a name and a link, so that is all that is requested/kept.
+# A full playlist object also carries the first page of full track objects (often hundreds of KB)
+PLAYLIST_FIELDS = 'name,external_urls.spotify'
+STALE_TTL = 24 * 3600 # seconds an entry is kept after it goes stale - served while it is refreshed, or while Spotify is down
+
+
+# Default category registry - what each /home_page/<category> page lists: an artist's albums
+# (spotify:artist:...) or playlists, in page order. The live registry is kept in the Tags and
+# Playlists tables (categories.py); this seeds them and stands in while they are empty
+CATEGORIES = {
+    'cleaning': ['spotify:artist:7tYKF4w9nC0nq9CsPZTHyP'], # SZA
+    'cooking': ['spotify:artist:2wY79sveU1sp5g7SokKOiI'], # Sam Smith
+    'gardening': ['spotify:playlist:37i9dQZF1DZ06evO0Co11u', 'spotify:playlist:37i9dQZF1EIeptNKrK95ex', 'spotify:playlist:37i9dQZF1DWV7EzJMK2FUI'],
+    'shopping': ['spotify:playlist:2P0VBAcUPSzjhgYUsIyjjb', 'spotify:playlist:2jMTSDkouGnpYE3JXAuRjy', 'spotify:playlist:59bquJNzpBVlzePmksrzZ7'],
+    'laundry': ['spotify:playlist:1ftFIOsNNt5mXJepj3wzuH', 'spotify:playlist:37i9dQZF1DWT0IiTU5mrJ9', 'spotify:playlist:4muHyvSwG1wP9sI4XihC5w'],
+    'diy': ['spotify:playlist:2njiabuQAJcRTKC4CDja47', 'spotify:playlist:4NMom1HAG5Nk2MvlueSsF7', 'spotify:playlist:3okUIpItRWF127C92YaXQ6'],
+    'finance': ['spotify:playlist:6E5WGfx9LF2rU1pqTGQlh5', 'spotify:playlist:0ZMw0qV3CyIuBuBObouD1L', 'spotify:playlist:31yp6AccQFiIwvC1SPnG7J'],
+    'home': ['spotify:playlist:7BdkdQkR7GANVz11eElkpn', 'spotify:playlist:2lB5UHNDgcQlSxafzqlUdq', 'spotify:playlist:0kgirc9upn9id02xsxutPT'],
+    'pets': ['spotify:playlist:2uXOLlA9SOwGKAWq8Ur5MH', 'spotify:playlist:0tMwcHD10Mw0St4JswNLUI', 'spotify:playlist:2R79wZ0MgXLUz33bBbKPIM'],
+    'childcare': ['spotify:playlist:1CKZs4Atk5gBaL40EUVZRg', 'spotify:playlist:37i9dQZF1DWVmLl2r5kAOQ', 'spotify:playlist:37i9dQZF1DX2UkbeRPWQqZ'],
+}
+
+
+def is_artist(uri):
+    return uri.startswith('spotify:artist:')
+
+
+# Reduces an album (or any catalog object) to the fields the pages render
+def metadata(item):
+    return {'name': item['name'], 'external_urls': {'spotify': item['external_urls']['spotify']}}
+
+
+# Spotify catalog lookups used by the /home_page/<category> pages
+# The URIs are fixed, so results are the same for every user and are served from a shared cache.
+# Entries are stale-while-revalidate: fresh for the cache TTL, then served as they are for up to
+# stale_ttl more seconds while one background refresh (background_client, which needs no user
+# session) replaces them. Only a missing entry makes a page wait for Spotify. At most one upstream
+# load runs per key at a time, whoever asks for it - pages, background refreshes or the warmer.
+# With a snapshot (snapshot.Snapshot) everything it holds is served from memory, without Spotify
+class Catalog:
+    def __init__(self, client, cache=None, max_workers=8, deadline=2.0, snapshot=None, background_client=None,
+                 stale_ttl=STALE_TTL, clock=time.time):
+        self.client = client # spotipy Spotify instance
+        self.cache = cache if cache is not None else Cache(namespace='catalog')
+        self.snapshot = snapshot
+        self.deadline = deadline # seconds a page waits for upstream lookups
+        self.background_client = background_client if background_client is not None else client
+        self.stale_ttl = stale_ttl
+        self.clock = clock # wall clock - freshness is shared between processes through Redis
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='catalog')
+        self.refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='catalog-refresh')
+        self.stale_served = 0
+        self.refresh_failures = 0
+        self._inflight = {} # cache key -> Future, so concurrent requests share one upstream call
+        self._lock = threading.RLock() # done callbacks may run inline while held
+
+    # Runs fn on a pool (the lookup pool by default) inside a copy of the caller's context, so the worker
+    # still sees the Flask request/session (spotipy reads the user's token from the session).
+    # If a call for the same key is already running, its Future is returned instead
+    def _submit(self, key, fn, *args, executor=None):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                ctx = contextvars.copy_context()
+                future = (executor or self.executor).submit(ctx.run, fn, *args)
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+            return future
+
+    # Runs fn on the calling thread, or waits for the call for the same key that is already running
+    def _run(self, key, fn, *args):
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._forget(key)
+        future.set_result(result)
+        return result
+
+    def _forget(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    # Cached entry of a key as {'value': ..., 'fresh_until': epoch seconds}, None when there is none
+    def _entry(self, key):
+        entry = self.cache.get(key)
+        if entry is MISSING or not isinstance(entry, dict) or 'fresh_until' not in entry: # plain values from before
+            return None
+        return entry
+
+    def _store(self, key, value):
+        self.cache.set(key, {'value': value, 'fresh_until': self.clock() + self.cache.ttl}, ttl=self.cache.ttl + self.stale_ttl)
+        return value
+
+    # Function to serve a stale entry - its refresh starts in the background unless one is running already
+    def _revalidate(self, key, fn, *args):
+        with self._lock:
+            self.stale_served += 1
+        self._submit(key, self._background, fn, *args, self.background_client, executor=self.refresh_executor)
+
+    def _background(self, fn, *args):
+        try:
+            return fn(*args)
+        except Exception as e: # the stale entry stays in place, the next view tries again
+            with self._lock:
+                self.refresh_failures += 1
+            logger.warning('Background catalog refresh failed: %s', e)
+            raise
+
+    def _load_playlist(self, uri, client):
+        return self._store(f'playlist-meta:{uri}', client.playlist(uri, fields=PLAYLIST_FIELDS))
+
+    # (the albums endpoint has no field filter, so items are trimmed before caching)
+    def _load_albums(self, uri, album_type, client):
+        items = self.fetch_all_pages(
+            lambda offset, limit: client.artist_albums(uri, album_type=album_type, limit=limit, offset=offset), client=client)
+        return self._store(f'album-meta:{album_type}:{uri}', [metadata(album) for album in items])
+
+    # Function to return a cached value - a stale one is returned as it is and refreshed in the background,
+    # a missing one is loaded on the calling thread (load(*args, client) stores it)
+    def _get(self, key, load, *args):
+        entry = self._entry(key)
+        if entry is None:
+            return self._run(key, load, *args, self.client)
+        if entry['fresh_until'] <= self.clock():
+            self._revalidate(key, load, *args)
+        return entry['value']
+
+    # Name and link of a playlist - Spotify only returns the projected fields
+    def playlist_metadata(self, uri):
+        cached = self.snapshot.playlist(uri) if self.snapshot is not None else None
+        return cached if cached is not None else self._get(f'playlist-meta:{uri}', self._load_playlist, uri)
+
+    # Metadata of several playlists at once - cache misses are fetched concurrently and the call returns
+    # when all have arrived or the deadline passes. Results keep the order of uris; a playlist
+    # that missed the deadline or failed is None (late results still land in the cache)
+    def playlists(self, uris, deadline=None):
+        results = {}
+        pending = {}
+        for uri in uris:
+            cached = self.snapshot.playlist(uri) if self.snapshot is not None else None
+            if cached is not None:
+                results[uri] = cached
+                continue
+            key = f'playlist-meta:{uri}'
+            entry = self._entry(key)
+            if entry is None:
+                pending[self._submit(key, self._load_playlist, uri, self.client)] = uri
+                continue
+            if entry['fresh_until'] <= self.clock():
+                self._revalidate(key, self._load_playlist, uri)
+            results[uri] = entry['value']
+
+        if pending:
+            done, not_done = wait(pending, timeout=self.deadline if deadline is None else deadline)
+            for future in done:
+                try:
+                    results[pending[future]] = future.result()
+                except Exception as e: # one failed playlist should not fail the page
+                    logger.warning('Spotify playlist lookup failed for %s: %s', pending[future], e)
+            for future in not_done:
+                logger.warning('Spotify playlist lookup for %s missed the deadline', pending[future])
+
+        return [results.get(uri) for uri in uris]
+
+    # Calls fn(*args) for every args tuple concurrently; results come back in the same order
+    def _map(self, fn, args_list):
+        futures = [self.executor.submit(contextvars.copy_context().run, fn, *args) for args in args_list]
+        return [future.result() for future in futures]
+
+    # Every item of a paginated Spotify endpoint. fetch_page(offset, limit) returns one paging
+    # object; the first page carries total and limit, so the remaining offsets are requested
+    # concurrently and merged back in order instead of following 'next' one page at a time
+    def fetch_all_pages(self, fetch_page, limit=50, client=None):
+        first = fetch_page(0, limit)
+        items = list(first['items'])
+        if 'total' not in first: # not a standard paging object - follow 'next' links instead
+            results = first
+            while results.get('next'):
+                results = (client or self.client).next(results)
+                items.extend(results['items'])
+            return items
+
+        page_size = first.get('limit') or limit
+        offsets = range(page_size, first['total'], page_size)
+        for page in self._map(fetch_page, [(offset, page_size) for offset in offsets]):
+            items.extend(page['items'])
+        return items
+
+    # Name and link of every album of an artist, all result pages combined
+    def artist_albums(self, uri, album_type='album'):
+        albums = self.snapshot.albums(uri, album_type) if self.snapshot is not None else None
+        if albums is not None:
+            return albums
+        return self._get(f'album-meta:{album_type}:{uri}', self._load_albums, uri, album_type)
+
+    # Function to tell whether the snapshot holds a playlist or artist, so it is served without Spotify
+    def in_snapshot(self, uri, album_type='album'):
+        if self.snapshot is None:
+            return False
+        return (self.snapshot.albums(uri, album_type) if is_artist(uri) else self.snapshot.playlist(uri)) is not None
+
+    # Function to tell when the cached data of a playlist or artist goes stale - None when nothing is
+    # cached, or the snapshot serves it (it never goes stale)
+    def fresh_until(self, uri, album_type='album'):
+        if self.in_snapshot(uri, album_type):
+            return None
+        entry = self._entry(f'album-meta:{album_type}:{uri}' if is_artist(uri) else f'playlist-meta:{uri}')
+        return entry['fresh_until'] if entry is not None else None
+
+    # Function to reload a playlist or artist from Spotify now, on the calling thread with background_client
+    # (for the warmer) - joins a load of the same key that is already running
+    def refresh(self, uri, album_type='album'):
+        if is_artist(uri):
+            return self._run(f'album-meta:{album_type}:{uri}', self._load_albums, uri, album_type, self.background_client)
+        return self._run(f'playlist-meta:{uri}', self._load_playlist, uri, self.background_client)
+
+    def stats(self):
+        return {'stale_served': self.stale_served, 'refresh_failures': self.refresh_failures, 'in_flight': len(self._inflight)}
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from markupsafe import escape
+from sqlalchemy import select, delete
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Tag, Playlist
+from catalog import CATEGORIES, is_artist
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 60.0 # seconds between reads of the registry tables, for changes made by other processes
+UNAVAILABLE = {
+    'playlist': 'This playlist is unavailable right now, please refresh the page to try again.',
+    'artist': 'These albums are unavailable right now, please refresh the page to try again.'
+}
+ITEM_CLASSES = {'gardening': 'a2'} # class attribute of a category's list items, as its page always had
+
+
+# Function to read the category registry from the Tags and Playlists tables - {tag_name: [uri, ...]} in p_id order
+def load_registry():
+    registry = {name: [] for name in db.session.execute(
+        select(Tag.tag_name).where(Tag.tag_name.isnot(None)).order_by(Tag.tag_id)).scalars()}
+    for tag, uri in db.session.execute(
+            select(Playlist.p_tag, Playlist.p_uri).where(Playlist.p_uri.isnot(None)).order_by(Playlist.p_id)):
+        registry.setdefault(tag, []).append(uri)
+    return registry
+
+
+# Function to replace what a category lists (the tag is created if it is new)
+def set_category(name, uris):
+    if db.session.execute(select(Tag.tag_id).where(Tag.tag_name == name)).first() is None:
+        db.session.add(Tag(tag_name=name))
+    db.session.execute(delete(Playlist).where(Playlist.p_tag == name))
+    db.session.add_all(Playlist(p_tag=name, p_uri=uri) for uri in uris)
+    db.session.commit()
+
+
+def _item_html(item, item_class=None):
+    name = escape(item['name'])
+    url = escape(item['external_urls']['spotify'])
+    li = f"<li class='{item_class}'>" if item_class else '<li>'
+    return f"{li}{name}: <a href='{url}' target='_blank'>{url}</a></li>"
+
+
+# The /home_page/<category> pages. The registry is held in memory and re-read every refresh_interval
+# seconds; each category's item list is rendered once and kept as HTML, so a page view is a
+# dictionary lookup. A kept fragment is dropped when the registry changes, when a new catalog
+# snapshot is loaded, or once the catalog data it was rendered from goes stale (at most ttl seconds).
+# Lists with unavailable items are not kept - the next view retries
+class CategoryPages:
+    def __init__(self, catalog, ttl=3600, refresh_interval=REFRESH_INTERVAL, defaults=CATEGORIES, clock=time.time):
+        self.catalog = catalog
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.defaults = defaults # served while the registry tables are empty (database not upgraded yet)
+        self.clock = clock # wall clock, like the catalog's freshness times
+        self.version = 0 # bumped whenever the registry changes
+        self.hits = 0
+        self.renders = 0
+        self._registry = None
+        self._checked = 0.0
+        self._fragments = {} # category -> (generation, expires_at, html)
+        self._lock = threading.Lock()
+
+    # Function to return the registry - re-read by one request once refresh_interval has passed
+    def registry(self):
+        if self._registry is None:
+            with self._lock:
+                if self._registry is None:
+                    self._reload()
+        elif self.clock() - self._checked >= self.refresh_interval and self._lock.acquire(blocking=False):
+            try:
+                self._reload()
+            finally:
+                self._lock.release()
+        return self._registry
+
+    # Function to re-read the registry now (after changing it in this process)
+    def reload(self):
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        self._checked = self.clock()
+        try:
+            registry = load_registry() or self.defaults
+        except SQLAlchemyError as e: # keeps serving what it has
+            db.session.rollback()
+            logger.error('Category registry could not be loaded: %s', e)
+            if self._registry is not None:
+                return
+            registry = self.defaults
+        if registry != self._registry:
+            self._registry = registry
+            self.version += 1
+            self._fragments = {}
+
+    # Function to drop every kept fragment (e.g. after clearing the catalog cache)
+    def invalidate(self):
+        self._fragments = {}
+
+    def _generation(self):
+        snapshot = self.catalog.snapshot
+        return self.version, snapshot.loads if snapshot is not None else 0
+
+    # Function to tell whether a category can be shown from the catalog snapshot alone - every playlist
+    # and artist it lists is in the snapshot, so the page needs no Spotify call (or user token)
+    def offline(self, name):
+        if self.catalog.snapshot is None:
+            return False
+        uris = self.registry().get(name)
+        return uris is not None and all(self.catalog.in_snapshot(uri) for uri in uris)
+
+    # Function to return the item list of a category as HTML - None for a category not in the registry
+    def fragment(self, name):
+        registry = self.registry()
+        if name not in registry:
+            return None
+        generation = self._generation()
+        entry = self._fragments.get(name)
+        if entry is not None and entry[0] == generation and entry[1] > self.clock():
+            self.hits += 1
+            return entry[2]
+        html, complete = self.render(registry[name], ITEM_CLASSES.get(name))
+        self.renders += 1
+        if complete:
+            fresh_until = [self.catalog.fresh_until(uri) for uri in registry[name]]
+            expires_at = min([self.clock() + self.ttl] + [until for until in fresh_until if until is not None])
+            self._fragments[name] = (generation, expires_at, html)
+        return html
+
+    # Function to render a list of playlists and artists (all their albums), in registry order.
+    # Playlist lookups run concurrently with the catalog's deadline. Returns (html, complete)
+    def render(self, uris, item_class=None):
+        playlist_uris = [uri for uri in uris if not is_artist(uri)]
+        playlists = dict(zip(playlist_uris, self.catalog.playlists(playlist_uris))) if playlist_uris else {}
+        items = []
+        complete = True
+        for uri in uris:
+            if is_artist(uri):
+                try:
+                    items.extend(_item_html(album, item_class) for album in self.catalog.artist_albums(uri, album_type='album'))
+                except Exception as e: # one failed artist should not fail the page
+                    logger.warning('Spotify album lookup failed for %s: %s', uri, e)
+                    items.append(f"<li>{UNAVAILABLE['artist']}</li>")
+                    complete = False
+            elif playlists[uri] is None:
+                items.append(f"<li>{UNAVAILABLE['playlist']}</li>")
+                complete = False
+            else:
+                items.append(_item_html(playlists[uri], item_class))
+        return '<ul>' + ''.join(items) + '</ul>', complete
+
+    def stats(self):
+        return {'categories': len(self._registry or ()), 'fragments': len(self._fragments), 'hits': self.hits,
+                'renders': self.renders, 'version': self.version}
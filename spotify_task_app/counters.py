@@ -0,0 +1,20 @@
+from sqlalchemy import update, insert
+from sqlalchemy.exc import IntegrityError
+from models import db
+
+# Counter rows - the summary tables (TaskStats, ArchiveSummaries, GoalRollups) keep counts that every
+# writer adds its change to, inside the transaction of the write they summarise
+
+
+# Function to add counts ({column: change}) to the row of model with primary key key ({column: value}),
+# creating the row on its first change. Runs inside the caller's transaction and does not commit
+def add(model, key, counts):
+    matches = [getattr(model, column) == value for column, value in key.items()]
+    increment = update(model).where(*matches).values({column: getattr(model, column) + change for column, change in counts.items()})
+    if db.session.execute(increment).rowcount:
+        return
+    try:
+        with db.session.begin_nested(): # first change to this row - another writer may be creating it too
+            db.session.execute(insert(model).values({**key, **counts}))
+    except IntegrityError:
+        db.session.execute(increment)
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+# Time spent waiting for a pooled connection - the signal that a worker's pool is too small
+class WaitStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.seconds_total += seconds
+            self.seconds_max = max(self.seconds_max, seconds)
+            self.timeouts += timed_out
+
+
+# QueuePool that measures how long each checkout waited for a connection
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = WaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.wait_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - started)
+        return connection
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes', 'on')
+
+
+# Function to build SQLALCHEMY_ENGINE_OPTIONS from the environment
+#   DB_POOL_SIZE, DB_MAX_OVERFLOW  - persistent / extra connections per worker process
+#   DB_POOL_TIMEOUT                - seconds to wait for a free connection before failing
+#   DB_POOL_RECYCLE                - seconds before a connection is replaced (keep below MySQL wait_timeout)
+#   DB_POOL_PRE_PING               - test connections on checkout so stale ones are replaced, not raised
+def engine_options(database_uri):
+    options = {
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800))
+    }
+    if make_url(database_uri).get_backend_name() != 'sqlite': # SQLite keeps Flask-SQLAlchemy's own pool setup
+        options.update({
+            'poolclass': TimedQueuePool,
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+            'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30))
+        })
+    return options
+
+
+# Function to report live statistics of an engine's connection pool
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0), # negative while the pool is still filling
+            'max_overflow': pool._max_overflow,
+            'timeout': pool.timeout()
+        })
+    wait_stats = getattr(pool, 'wait_stats', None)
+    if wait_stats is not None:
+        stats.update({
+            'checkouts': wait_stats.checkouts,
+            'wait_seconds_total': wait_stats.seconds_total,
+            'wait_seconds_max': wait_stats.seconds_max,
+            'wait_seconds_avg': wait_stats.seconds_total / wait_stats.checkouts if wait_stats.checkouts else 0.0,
+            'timeouts': wait_stats.timeouts
+        })
+    return stats
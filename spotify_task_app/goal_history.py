@@ -0,0 +1,138 @@
+import logging
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, insert, delete
+from models import db, Goal, GoalProgress, GoalRollup
+import counters
+
+logger = logging.getLogger(__name__)
+
+# Goal progress history. Updating a goal's progress overwrites Goals.goal_progress, so every update is
+# also appended to GoalProgressLog - a narrow row (goal, owner, time, progress code) - and added to the
+# owner's daily and weekly GoalRollups rows, in the same transaction as the update. The owner is logged as
+# it was at the time, so a goal reassigned or deleted later leaves its past updates with their owner. Streaks and
+# trends read a year of daily rows and a few weekly rows per owner, never the log itself.
+# rebuild() recomputes the rollups from the log
+
+PROGRESS = tuple(reversed(Goal.goal_progress.type.enums)) # code -> progress, 'Not Today' 0 to 'Achieved' 3
+PROGRESS_CODES = {progress: code for code, progress in enumerate(PROGRESS)} # the code doubles as a score
+ACHIEVED = PROGRESS_CODES['Achieved']
+DAY, WEEK = 'd', 'w' # GoalRollups.period
+STREAK_DAYS = 366 # daily rows read for streaks - the longest streak is the longest within this window
+DAYS_SHOWN = 14
+WEEKS_SHOWN = 8
+HISTORY_LIMIT = 50 # log entries listed for one goal
+
+
+# Function to return the Monday a day's week starts on
+def week_of(day):
+    return day - timedelta(days=day.weekday())
+
+
+# Function to return the rollup rows an update counts in and what it adds to them
+def rollups_of(owner, day, code):
+    counts = {'updates': 1, 'achieved': int(code == ACHIEVED), 'score': code}
+    return [((owner, DAY, day), counts), ((owner, WEEK, week_of(day)), counts)]
+
+
+# Function to log a progress update of a goal and add it to its owner's rollups. Runs inside the caller's
+# transaction and does not commit, so the history changes exactly when the goal does
+def record(goal_id, owner, progress, at=None):
+    at = at or datetime.now()
+    code = PROGRESS_CODES[progress]
+    db.session.execute(insert(GoalProgress).values(goal_id=goal_id, goal_owner=owner, logged_at=int(at.timestamp()),
+                                                   progress=code))
+    for (owner, period, start), counts in rollups_of(owner, at.date(), code):
+        counters.add(GoalRollup, {'goal_owner': owner, 'period': period, 'period_start': start}, counts)
+
+
+# Function to list the logged updates of one goal, newest first
+def history(goal_id, limit=HISTORY_LIMIT):
+    rows = db.session.execute(select(GoalProgress.logged_at, GoalProgress.progress)
+                              .where(GoalProgress.goal_id == goal_id)
+                              .order_by(GoalProgress.logged_at.desc(), GoalProgress.entry_id.desc()) # (goal_id, logged_at) index
+                              .limit(limit)).all()
+    return [{'progress': PROGRESS[row.progress], 'logged_at': datetime.fromtimestamp(row.logged_at)} for row in rows]
+
+
+def _period(start, row):
+    updates = row.updates if row else 0
+    return {'start': start.isoformat(), 'updates': updates, 'achieved': row.achieved if row else 0,
+            'average': row.score / updates if updates else None}
+
+
+# Function to summarise an owner's goal progress from the rollups - the current streak (days in a row with
+# a goal achieved, up to today or yesterday while today has none yet) and the longest one within a year,
+# the last days (newest first) and the last weeks (oldest first) with their change in average progress
+def summary(owner, today=None, days=DAYS_SHOWN, weeks=WEEKS_SHOWN):
+    today = today or date.today()
+    daily = {row.period_start: row for row in db.session.execute(
+        select(GoalRollup).where(GoalRollup.goal_owner == owner, GoalRollup.period == DAY,
+                                 GoalRollup.period_start > today - timedelta(days=STREAK_DAYS),
+                                 GoalRollup.period_start <= today)).scalars()}
+    achieved = {day for day, row in daily.items() if row.achieved}
+
+    day = today if today in achieved else today - timedelta(days=1)
+    streak = 0
+    while day in achieved:
+        streak += 1
+        day -= timedelta(days=1)
+    longest = run = 0
+    for day in sorted(achieved):
+        run = run + 1 if day - timedelta(days=1) in achieved else 1
+        longest = max(longest, run)
+
+    this_week = week_of(today)
+    weekly = {row.period_start: row for row in db.session.execute(
+        select(GoalRollup).where(GoalRollup.goal_owner == owner, GoalRollup.period == WEEK,
+                                 GoalRollup.period_start > this_week - timedelta(weeks=weeks),
+                                 GoalRollup.period_start <= this_week)).scalars()}
+    trend = []
+    for start in (this_week - timedelta(weeks=n) for n in reversed(range(weeks))):
+        entry = _period(start, weekly.get(start))
+        previous = trend[-1]['average'] if trend else None
+        entry['change'] = entry['average'] - previous if entry['average'] is not None and previous is not None else None
+        trend.append(entry)
+
+    return {
+        'streak': streak,
+        'longest_streak': longest,
+        'days': [_period(day, daily.get(day)) for day in (today - timedelta(days=n) for n in range(days))],
+        'weeks': trend
+    }
+
+
+# Function to recompute every rollup from the log and correct the stored rows that are wrong (updates
+# written outside the app, or logged before the rollups existed). The stored rows are locked first, so
+# updates that would change them wait until the corrected rows are committed. Returns the number of
+# rollups and of corrected rollups
+def rebuild():
+    started = time.perf_counter()
+    stored = {(row.goal_owner, row.period, row.period_start): (row.updates, row.achieved, row.score)
+              for row in db.session.execute(select(GoalRollup).with_for_update()).scalars()}
+    actual = {}
+    log = (select(GoalProgress.goal_owner, GoalProgress.logged_at, GoalProgress.progress) # the owner record() counted it for
+           .execution_options(yield_per=1000)) # streamed - the log is the largest goal table
+    for owner, logged_at, code in db.session.execute(log):
+        for key, counts in rollups_of(owner, datetime.fromtimestamp(logged_at).date(), code):
+            actual.setdefault(key, Counter()).update(counts)
+    actual = {key: (counts['updates'], counts['achieved'], counts['score']) for key, counts in actual.items()}
+
+    corrected = 0
+    for key in stored.keys() - actual.keys():
+        owner, period, start = key
+        db.session.execute(delete(GoalRollup).where(GoalRollup.goal_owner == owner, GoalRollup.period == period,
+                                                    GoalRollup.period_start == start))
+        corrected += 1
+    for key, (updates, achieved, score) in actual.items():
+        if stored.get(key) != (updates, achieved, score):
+            owner, period, start = key
+            db.session.merge(GoalRollup(goal_owner=owner, period=period, period_start=start,
+                                        updates=updates, achieved=achieved, score=score))
+            corrected += 1
+    db.session.commit()
+    result = {'rollups': len(actual), 'corrected': corrected, 'seconds': time.perf_counter() - started}
+    if corrected:
+        logger.warning('Goal rollups: corrected %d of %d rows', corrected, len(actual))
+    return result
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+# Raised when the hashing pool is full - callers should answer "busy, try again" straight away
+class HashingBusy(Exception):
+    pass
+
+
+# Latency of password hashes and checks, plus how many were turned away
+class HashStats:
+    def __init__(self):
+        self.counts = {'hash': 0, 'check': 0}
+        self.seconds = {'hash': 0.0, 'check': 0.0}
+        self.seconds_max = {'hash': 0.0, 'check': 0.0}
+        self.rejected = 0
+        self.rehashed = 0
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds):
+        with self._lock:
+            self.counts[operation] += 1
+            self.seconds[operation] += seconds
+            self.seconds_max[operation] = max(self.seconds_max[operation], seconds)
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def record_rehash(self):
+        with self._lock:
+            self.rehashed += 1
+
+    def as_dict(self):
+        return {
+            operation: {
+                'count': self.counts[operation],
+                'seconds_total': self.seconds[operation],
+                'seconds_max': self.seconds_max[operation],
+                'seconds_avg': self.seconds[operation] / self.counts[operation] if self.counts[operation] else 0.0
+            } for operation in self.counts
+        } | {'rejected': self.rejected, 'rehashed': self.rehashed}
+
+
+# Runs password hashing on a small bounded thread pool instead of the request thread.
+# werkzeug's scrypt/pbkdf2 run in hashlib, which releases the GIL, so the pool uses real cores.
+# At most max_workers + max_queue hashes are admitted at once; beyond that HashingBusy is raised
+# immediately, so a login peak queues a bounded amount of work instead of stalling every worker
+class PasswordHasher:
+    def __init__(self, method='scrypt', max_workers=2, max_queue=32, timeout=10.0):
+        self.method = method
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hashing')
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.stats = HashStats()
+        self._prefix = None
+
+    def _run(self, operation, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            self.stats.record_rejected()
+            raise HashingBusy('Too many logins in progress')
+        def timed():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self.stats.record(operation, time.perf_counter() - started)
+        future = self.executor.submit(timed)
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self.stats.record_rejected()
+            raise HashingBusy('Password hashing timed out')
+
+    # Function to hash a password with the configured method
+    def hash(self, password):
+        return self._run('hash', generate_password_hash, password, self.method)
+
+    # Function to check a password against a stored hash
+    def check(self, stored_hash, password):
+        return self._run('check', check_password_hash, stored_hash, password)
+
+    # Function to tell whether a stored hash uses a different method or cost than the configured one
+    # (werkzeug stores 'method:params$salt$hash', e.g. 'scrypt:32768:8:1$...')
+    def needs_rehash(self, stored_hash):
+        if self._prefix is None: # expand defaults, e.g. 'scrypt' -> 'scrypt:32768:8:1', once
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return stored_hash.split('$', 1)[0] != self._prefix
+
+
+# Shared hasher - PASSWORD_HASH_METHOD is any werkzeug method string, e.g. 'scrypt' or 'pbkdf2:sha256:600000'
+hasher = PasswordHasher(
+    method=os.getenv('PASSWORD_HASH_METHOD', 'scrypt'),
+    max_workers=int(os.getenv('HASH_WORKERS', os.cpu_count() or 2)),
+    max_queue=int(os.getenv('HASH_QUEUE_DEPTH', 32)),
+    timeout=float(os.getenv('HASH_TIMEOUT', 10.0))
+)
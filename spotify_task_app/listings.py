@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import time
+from sqlalchemy import inspect
+from cache import Cache, make_backend, MISSING
+
+# Listing cache - query results of the overview pages, keyed by a version counter per listing.
+# Every write path bumps the counter of the listings it changes, so a cached page is never served
+# after a write; old entries are simply never asked for again and age out with the TTL.
+# Set CACHE_REDIS_URL to share results and counters between worker processes
+backend = make_backend(os.getenv('CACHE_REDIS_URL'), max_size=int(os.getenv('LISTING_CACHE_SIZE', 1024)))
+pages = Cache(backend, ttl=int(os.getenv('LISTING_CACHE_TTL', 300)), namespace='listings')
+versions = Cache(backend, namespace='listing-version')
+
+# Listing names - goals are cached per owner
+TASKS = 'tasks'
+ARCHIVE = 'archive'
+
+
+def goals_listing(owner):
+    return f'goals:{owner}'
+
+
+# Seed for a counter that is missing (first use, evicted, Redis restarted) - the time in microseconds,
+# so a restarted counter starts above any value the lost one can have reached
+def _seed():
+    return time.time_ns() // 1000
+
+
+# Function to return the current version of a listing - None when the cache cannot be reached
+def version(listing):
+    current = versions.get(listing)
+    if current is MISSING:
+        current = versions.incr(listing, _seed())
+    return current
+
+
+# Function to mark listings as changed - call after the write has been committed
+def bump(*listings):
+    for listing in listings:
+        versions.incr(listing, _seed())
+        versions.set(f'{listing}:modified', time.time(), ttl=0) # for Last-Modified, kept until the next write
+
+
+# Function to return when a listing last changed (epoch seconds) - None if not known since the cache started
+def modified(listing):
+    changed = versions.get(f'{listing}:modified')
+    return None if changed is MISSING else changed
+
+
+# Function to build an ETag from a listing version and whatever else the rendered page depends on
+def etag(listing, current, *parts):
+    return hashlib.sha1(json.dumps([listing, current, *parts], default=str).encode()).hexdigest()
+
+
+# Function to turn ORM rows into plain dicts that any backend can store (templates read them the
+# same way, task.task_name works on both). Datetimes are stored as they are displayed
+def as_rows(objects):
+    rows = []
+    for obj in objects:
+        row = {}
+        for attribute in inspect(obj).mapper.column_attrs:
+            value = getattr(obj, attribute.key)
+            row[attribute.key] = str(value) if hasattr(value, 'isoformat') else value
+        rows.append(row)
+    return rows
+
+
+# Function to return loader()'s result for the current version of a listing, from the cache when possible
+def cached(listing, options, loader):
+    current = version(listing)
+    if current is None: # cache unavailable - straight to the database
+        return loader()
+    key = hashlib.sha1(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()
+    return pages.get_or_set(f'{listing}:{current}:{key}', loader)
+
+
+# Function to cache one page of a keyset-paginated listing (get_tasks_page / get_archived_tasks_page)
+# Returns (rows as dicts, next cursor) like the page helpers
+def cached_page(listing, page_helper, **options):
+    def load():
+        rows, next_cursor = page_helper(**options)
+        return {'rows': as_rows(rows), 'next_cursor': next_cursor}
+    page = cached(listing, options, load)
+    return page['rows'], page['next_cursor']
+
+
+# Hit/miss counters of the listing cache
+def stats():
+    return pages.stats()
@@ -27,7 +27,14 @@ CREATE TABLE IF NOT EXISTS Tasks (
     task_owner VARCHAR(255),
     task_tag ENUM('cleaning', 'cooking', 'shopping', 'gardening', 'laundry', 'DIY', 'finance', 'home', 'pets', 'childcare'),
     task_due DATETIME,
-    task_status ENUM('New', 'In Progress', 'Completed')
+    task_status ENUM('New', 'In Progress', 'Completed'),
+    -- indexes backing the keyset-paginated tasks overview (sort key + id, filter columns first)
+    INDEX ix_tasks_due_id (task_due, task_id),
+    INDEX ix_tasks_status_id (task_status, task_id),
+    INDEX ix_tasks_tag_due_id (task_tag, task_due, task_id),
+    INDEX ix_tasks_owner_due_id (task_owner, task_due, task_id),
+    INDEX ix_tasks_status_due (task_status, task_due), -- due today/overdue/upcoming range queries
+    FULLTEXT INDEX ft_tasks_text (task_name, task_description) -- task search
 );
 
 -- Archived Tasks table
@@ -40,7 +47,32 @@ CREATE TABLE IF NOT EXISTS ArchivedTasks (
     task_owner VARCHAR(255),
     task_tag ENUM('cleaning', 'cooking', 'shopping', 'gardening', 'laundry', 'DIY', 'finance', 'home', 'pets', 'childcare'),
     task_due DATETIME, -- add not null?
-    task_status ENUM('New', 'In Progress', 'Completed')
+    task_status ENUM('New', 'In Progress', 'Completed'),
+    archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP, -- month partitions: flask --app app partition-archive
+    -- indexes backing the keyset-paginated archive overview
+    INDEX ix_archived_due_id (task_due, a_id),
+    INDEX ix_archived_tag_due_id (task_tag, task_due, a_id),
+    INDEX ix_archived_owner_due_id (task_owner, task_due, a_id),
+    INDEX ix_archived_at_id (archived_at, a_id),
+    INDEX ix_archived_task_id (task_id, a_id),
+    FULLTEXT INDEX ft_archived_text (task_name, task_description) -- dropped when the table is partitioned
+);
+
+-- Archive summaries - archived tasks per month, tag and owner, for months compacted after ARCHIVE_RETENTION_MONTHS
+
+CREATE TABLE IF NOT EXISTS ArchiveSummaries (
+    month CHAR(7) NOT NULL,
+    task_tag VARCHAR(20) NOT NULL,
+    task_owner VARCHAR(255) NOT NULL,
+    task_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, task_tag, task_owner)
+);
+
+-- Compacted partitions - archive partitions already counted in ArchiveSummaries, dropped on the next run if the DROP failed
+
+CREATE TABLE IF NOT EXISTS CompactedPartitions (
+    partition_name VARCHAR(16) NOT NULL PRIMARY KEY,
+    compacted_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Goals table
@@ -60,12 +92,13 @@ CREATE TABLE IF NOT EXISTS Hobbies (
     hobby_name VARCHAR(255) NOT NULL
 );
 
--- Playlists table - for future application improvements
+-- Playlists table - what each category page lists (p_tag is Tags.tag_name, p_uri a Spotify playlist or artist)
 
 CREATE TABLE IF NOT EXISTS Playlists (
     p_id INTEGER AUTO_INCREMENT PRIMARY KEY,
     p_name VARCHAR(255),
-    p_tag VARCHAR(255)
+    p_tag VARCHAR(255),
+    p_uri VARCHAR(255)
 );
 
 -- Task Owner table
@@ -78,6 +111,40 @@ CREATE TABLE IF NOT EXISTS TaskOwner (
     FOREIGN KEY (user_id) REFERENCES Users(user_id)
 );
 
+-- Task statistics - task counts per group, updated with every task write (due_day only for open tasks)
+
+CREATE TABLE IF NOT EXISTS TaskStats (
+    source VARCHAR(10) NOT NULL,
+    task_tag VARCHAR(20) NOT NULL,
+    task_status VARCHAR(20) NOT NULL,
+    task_owner VARCHAR(255) NOT NULL,
+    due_day VARCHAR(10) NOT NULL,
+    task_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, task_tag, task_status, task_owner, due_day)
+);
+
+-- Goal progress history (goal_history.py) - every progress update, as integer codes
+-- ('Not Today' 0, 'Attempted' 1, 'Almost Achieved' 2, 'Achieved' 3), and counts per owner and day / week
+
+CREATE TABLE IF NOT EXISTS GoalProgressLog (
+    entry_id INTEGER AUTO_INCREMENT PRIMARY KEY,
+    goal_id INTEGER NOT NULL,
+    goal_owner VARCHAR(255) NOT NULL DEFAULT '',
+    logged_at INTEGER NOT NULL,
+    progress SMALLINT NOT NULL,
+    INDEX ix_goal_log_goal (goal_id, logged_at)
+);
+
+CREATE TABLE IF NOT EXISTS GoalRollups (
+    goal_owner VARCHAR(255) NOT NULL,
+    period CHAR(1) NOT NULL,
+    period_start DATE NOT NULL,
+    updates INTEGER NOT NULL DEFAULT 0,
+    achieved INTEGER NOT NULL DEFAULT 0,
+    score INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (goal_owner, period, period_start)
+);
+
 -- Insert sample data into Tasks table
 INSERT INTO Tasks
 (task_name, task_description, task_owner, task_tag, task_due, task_status)
@@ -100,58 +167,16 @@ SELECT * FROM Users;
 SELECT * FROM Tasks WHERE task_due >= '2024-08-06';
 
 
--- Trigger to add completed tasks to ArchivedTasks once updated as completed by user throught the app
-
-DELIMITER //
+-- Completed tasks are moved to ArchivedTasks by the application (archiver.py) in batches -
+-- on a schedule (ARCHIVE_INTERVAL), when a task is completed, or with: flask --app app archive-tasks
+-- The old trigger / procedure / per-second event are removed from existing databases here,
+-- otherwise completed tasks would be archived twice
 
-CREATE TRIGGER archive_tasks
-AFTER UPDATE ON Tasks
-FOR EACH ROW
-BEGIN
-    IF NEW.task_status = 'Completed' THEN
-        INSERT INTO ArchivedTasks (task_id, task_name, task_description, task_owner, task_tag, task_due, task_status)
-        VALUES (NEW.task_id, NEW.task_name, NEW.task_description, NEW.task_owner, NEW.task_tag, NEW.task_due, NEW.task_status);
-    END IF;
-END //
+DROP EVENT IF EXISTS remove_completed;
+DROP TRIGGER IF EXISTS archive_tasks;
+DROP PROCEDURE IF EXISTS delete_tasks;
 
-DELIMITER ;
-
--- Trigger check
+-- Archive check
 
 SELECT * FROM ArchivedTasks;
 SELECT * FROM Tasks;
-
--- Stored procedure to delete tasks from Tasks table once archived
-
-DELIMITER //
-
-CREATE PROCEDURE delete_tasks()
-BEGIN
-	DELETE FROM Tasks
-    WHERE task_id IN (SELECT task_id FROM ArchivedTasks);
-END //
-
-DELIMITER ;
-
-
--- START TRANSACTION;
--- CALL delete_tasks();
-
--- ROLLBACK;
--- COMMIT;
--- DROP PROCEDURE delete_tasks;
-
-
--- Scheduled event to call delete tasks procedure every second 
-
-SET GLOBAL event_scheduler = ON;
-
-DELIMITER //
-CREATE EVENT IF NOT EXISTS remove_completed
-ON SCHEDULE EVERY 1 SECOND
-DO
-CALL delete_tasks(); //
-
-DELIMITER ;
-
-
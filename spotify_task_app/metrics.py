@@ -0,0 +1,274 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from flask import g, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from spotipy import Spotify
+
+# Per-request instrumentation - SQL statements (engine events), Spotify calls (TimedSpotify) and
+# template rendering (Flask signals, or timed_stream() for streamed pages) are timed for every request and exported in the Prometheus
+# text format by expose(). Values are per worker process; Prometheus scrapes each worker.
+# Kept dependency-free: the few metric types needed are implemented here
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=SECONDS_BUCKETS, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._values = {} # label values -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts = self._values.setdefault(label_values, [0] * (len(self.buckets) + 2))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        lines = []
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    lines.append((f'{self.name}_bucket', _format_labels(self.labels, key, [('le', _format_value(bound))]), cumulative))
+                lines.append((f'{self.name}_sum', _format_labels(self.labels, key), counts[-1]))
+                lines.append((f'{self.name}_count', _format_labels(self.labels, key), cumulative))
+        return lines
+
+
+REQUESTS = Counter('http_requests_total', 'Requests handled', ('endpoint', 'status'))
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request time, including streaming the response', labels=('endpoint',))
+REQUEST_SQL = Histogram('http_request_sql_queries', 'SQL statements per request', COUNT_BUCKETS, ('endpoint',))
+REQUEST_SQL_SECONDS = Histogram('http_request_sql_seconds', 'Time in SQL statements per request', labels=('endpoint',))
+REQUEST_SPOTIFY = Histogram('http_request_spotify_calls', 'Spotify API calls per request', COUNT_BUCKETS, ('endpoint',))
+REQUEST_SPOTIFY_SECONDS = Histogram('http_request_spotify_seconds', 'Time in Spotify API calls per request (calls can overlap)', labels=('endpoint',))
+REQUEST_RENDER_SECONDS = Histogram('http_request_render_seconds', 'Template rendering time per request', labels=('endpoint',))
+SQL_SECONDS = Histogram('db_query_duration_seconds', 'Duration of every SQL statement, including background jobs')
+SPOTIFY_SECONDS = Histogram('spotify_call_duration_seconds', 'Duration of every Spotify API call')
+
+METRICS = [REQUESTS, REQUEST_SECONDS, REQUEST_SQL, REQUEST_SQL_SECONDS, REQUEST_SPOTIFY, REQUEST_SPOTIFY_SECONDS,
+           REQUEST_RENDER_SECONDS, SQL_SECONDS, SPOTIFY_SECONDS]
+_collectors = []
+
+
+# Function to add values computed at scrape time (cache, pool, archiver statistics).
+# collector() returns a list of (name, type, help, [(labels dict, value)])
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+# Time spent by one request in each part of the stack. Spotify calls run on the catalog's worker
+# threads, which see this object through the copied context, so updates take a lock
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.status = None
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.spotify_count = 0
+        self.spotify_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = []
+        self._lock = threading.Lock()
+
+    def add_sql(self, seconds):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_seconds += seconds
+
+    def add_spotify(self, seconds):
+        with self._lock:
+            self.spotify_count += 1
+            self.spotify_seconds += seconds
+
+    def add_render(self, seconds):
+        with self._lock:
+            self.render_seconds += seconds
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+# Function to return the metrics of the request being handled (None outside requests)
+def current():
+    return _current.get()
+
+
+# Spotify client that times every API call (one HTTP round trip each)
+class TimedSpotify(Spotify):
+    def _internal_call(self, method, url, payload, params):
+        started = time.perf_counter()
+        try:
+            return super()._internal_call(method, url, payload, params)
+        finally:
+            seconds = time.perf_counter() - started
+            SPOTIFY_SECONDS.observe(seconds)
+            metrics = current()
+            if metrics is not None:
+                metrics.add_spotify(seconds)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - context._metrics_started
+    SQL_SECONDS.observe(seconds)
+    metrics = current()
+    if metrics is not None:
+        metrics.add_sql(seconds)
+
+
+def _render_started(sender, template, context, **extra):
+    metrics = current()
+    if metrics is not None:
+        metrics.render_started.append(time.perf_counter())
+
+
+def _render_finished(sender, template, context, **extra):
+    metrics = current()
+    if metrics is not None and metrics.render_started:
+        metrics.add_render(time.perf_counter() - metrics.render_started.pop())
+
+
+def _timed_chunks(chunks, metrics):
+    iterator = iter(chunks)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                metrics.add_render(time.perf_counter() - started)
+            yield chunk
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+
+
+# Function to time a streamed template (template.stream()) - streams fire no render signals, so the time
+# spent producing each chunk is added to the request's render time instead. Returns the chunks to send
+def timed_stream(chunks):
+    metrics = current()
+    return chunks if metrics is None else _timed_chunks(chunks, metrics)
+
+
+_events_installed = False
+
+
+# Function to instrument an app. SLOW_REQUEST_SECONDS in the app config (0 disables) logs every
+# request slower than that with its SQL / Spotify / render breakdown
+def init_app(app):
+    global _events_installed
+    if not _events_installed: # engine events are global - installed once per process
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _events_installed = True
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_metrics = RequestMetrics()
+        _current.set(g.request_metrics)
+
+    @app.after_request
+    def record_status(response):
+        metrics = g.get('request_metrics')
+        if metrics is not None:
+            metrics.status = response.status_code
+        return response
+
+    # teardown runs after a streamed response has been sent, so the totals include streaming
+    @app.teardown_request
+    def finish_request_metrics(error=None):
+        metrics = g.pop('request_metrics', None)
+        _current.set(None)
+        if metrics is None:
+            return
+        seconds = time.perf_counter() - metrics.started
+        endpoint = request.endpoint or 'unmatched'
+        REQUESTS.inc(endpoint, metrics.status or 500)
+        REQUEST_SECONDS.observe(seconds, endpoint)
+        REQUEST_SQL.observe(metrics.sql_count, endpoint)
+        REQUEST_SQL_SECONDS.observe(metrics.sql_seconds, endpoint)
+        REQUEST_SPOTIFY.observe(metrics.spotify_count, endpoint)
+        REQUEST_SPOTIFY_SECONDS.observe(metrics.spotify_seconds, endpoint)
+        REQUEST_RENDER_SECONDS.observe(metrics.render_seconds, endpoint)
+        slow = app.config.get('SLOW_REQUEST_SECONDS')
+        if slow and seconds >= slow:
+            logger.warning('Slow request %s %s %s %.3fs - sql %d (%.3fs), spotify %d (%.3fs), render %.3fs',
+                           request.method, request.path, metrics.status, seconds, metrics.sql_count, metrics.sql_seconds,
+                           metrics.spotify_count, metrics.spotify_seconds, metrics.render_seconds)
+
+
+# Function to render every metric in the Prometheus text format
+def expose():
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(f'{name}{labels} {_format_value(value)}' for name, labels, value in metric.samples())
+    for collector in _collectors:
+        try:
+            families = collector()
+        except Exception as e: # a failing source should not take the whole endpoint down
+            logger.error('Metrics collector failed: %s', e)
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                if value is not None:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,275 @@
+from datetime import datetime
+from sqlalchemy import inspect, select, update, bindparam, type_coerce, text, func, String, DateTime
+from models import db, Task, ArchivedTasks, Tag, Playlist, TaskStat, ArchiveSummary, CompactedPartition, Goal, GoalProgress, GoalRollup
+from catalog import CATEGORIES
+from search import FULLTEXT_INDEXES
+import task_stats
+import retention
+
+BATCH_SIZE = 1000 # rows rewritten per transaction
+
+# Formats task_due strings were stored in before the column became DATETIME
+# (form posts are '%Y-%m-%dT%H:%M', sample data and tests used '%Y-%m-%d %H:%M:%S' or a bare date)
+DUE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+# Function to parse a stored due date string - None if it matches no known format
+def parse_due(value):
+    for due_format in DUE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), due_format)
+        except ValueError:
+            continue
+    return None
+
+
+# Function to create any index declared on the models that the database does not have yet, or has with
+# other columns (indexes on columns a later migration adds are left to that migration)
+def ensure_indexes(model):
+    inspector = inspect(db.engine)
+    existing = {index['name']: index['column_names'] for index in inspector.get_indexes(model.__tablename__)}
+    columns = {column['name'] for column in inspector.get_columns(model.__tablename__)}
+    created = []
+    for index in model.__table__.indexes:
+        wanted = [column.name for column in index.columns]
+        if existing.get(index.name) == wanted or not set(wanted) <= columns:
+            continue
+        if index.name in existing: # an older definition (e.g. ending in task_id) - rebuilt with the model's columns
+            index.drop(db.engine)
+        index.create(db.engine)
+        created.append(index.name)
+    return created
+
+
+# Function to rewrite every task_due string of a table as a real datetime, in keyset batches
+# Returns (converted, cleared) - cleared rows held text that is not a date and are set to NULL
+def _convert_due_strings(table):
+    raw_due = type_coerce(table.c.task_due, String) # read the stored text as-is
+    rewrite = (update(table)
+               .where(table.c.task_id == bindparam('row_id'))
+               .values(task_due=bindparam('due', type_=DateTime)))
+    converted = cleared = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.task_id, raw_due)
+            .where(table.c.task_id > last_id, table.c.task_due.isnot(None))
+            .order_by(table.c.task_id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return converted, cleared
+        params = []
+        for task_id, due in rows:
+            parsed = parse_due(due) if isinstance(due, str) else due
+            cleared += parsed is None
+            converted += parsed is not None
+            params.append({'row_id': task_id, 'due': parsed})
+        db.session.execute(rewrite, params)
+        db.session.commit() # one bounded transaction per batch
+        last_id = rows[-1][0]
+
+
+# Objects of the old in-database archiving that the application's archiver replaces - (kind, name, query finding it)
+LEGACY_ARCHIVING = (
+    ('TRIGGER', 'archive_tasks', 'SELECT 1 FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = :name'),
+    ('EVENT', 'remove_completed', 'SELECT 1 FROM information_schema.EVENTS WHERE EVENT_SCHEMA = DATABASE() AND EVENT_NAME = :name'),
+    ('PROCEDURE', 'delete_tasks', "SELECT 1 FROM information_schema.ROUTINES WHERE ROUTINE_SCHEMA = DATABASE() AND ROUTINE_NAME = :name AND ROUTINE_TYPE = 'PROCEDURE'"),
+)
+
+
+# Migration (MySQL) - drops the old archive trigger, event and procedure. While the trigger exists it copies
+# every completed task into ArchivedTasks before the archiver does, so completed tasks are archived twice
+def drop_legacy_archiving():
+    if db.engine.dialect.name != 'mysql':
+        return []
+    messages = []
+    for kind, name, exists in LEGACY_ARCHIVING:
+        if db.session.execute(text(exists), {'name': name}).first() is not None:
+            db.session.execute(text(f'DROP {kind} IF EXISTS {name}'))
+            messages.append(f'{kind.lower()} {name}: dropped')
+    db.session.commit()
+    return messages
+
+
+# Migration - task_due moves from VARCHAR(100) to DATETIME on Tasks and ArchivedTasks
+# (databases created from manager.sql already have DATETIME; ones created by db.create_all() do not)
+def task_due_to_datetime():
+    messages = []
+    inspector = inspect(db.engine)
+    for model in (Task, ArchivedTasks):
+        table = model.__table__
+        if not inspector.has_table(table.name):
+            continue
+        column = next(column for column in inspector.get_columns(table.name) if column['name'] == 'task_due')
+        if not isinstance(column['type'], DateTime):
+            converted, cleared = _convert_due_strings(table)
+            if db.engine.dialect.name == 'mysql':
+                db.session.execute(text(f'ALTER TABLE {table.name} MODIFY task_due DATETIME NULL'))
+                db.session.commit()
+            # SQLite keeps the declared column type, but the values are now stored in the DateTime format
+            messages.append(f'{table.name}.task_due: {converted} converted, {cleared} unparseable cleared')
+        created = ensure_indexes(model)
+        if created:
+            messages.append(f'{table.name}: created {", ".join(created)}')
+    return messages
+
+
+# Migration - the Tags and Playlists tables hold the category registry: Playlists gains p_uri, and an
+# empty registry is seeded with the default categories (catalog.CATEGORIES)
+def category_registry():
+    messages = []
+    inspector = inspect(db.engine)
+    for model in (Tag, Playlist):
+        if not inspector.has_table(model.__tablename__):
+            model.__table__.create(db.engine)
+            messages.append(f'{model.__tablename__}: created')
+        elif model is Playlist and 'p_uri' not in {column['name'] for column in inspector.get_columns('Playlists')}:
+            db.session.execute(text('ALTER TABLE Playlists ADD COLUMN p_uri VARCHAR(255) NULL'))
+            db.session.commit()
+            messages.append('Playlists: added p_uri')
+    if db.session.execute(select(Playlist.p_id).where(Playlist.p_uri.isnot(None)).limit(1)).first() is None:
+        existing = set(db.session.execute(select(Tag.tag_name)).scalars())
+        db.session.add_all(Tag(tag_name=name) for name in CATEGORIES if name not in existing)
+        db.session.add_all(Playlist(p_tag=name, p_uri=uri) for name, uris in CATEGORIES.items() for uri in uris)
+        db.session.commit()
+        messages.append(f'Category registry: seeded {len(CATEGORIES)} categories')
+    return messages
+
+
+# Migration - FULLTEXT indexes for task search (MySQL only - elsewhere search keeps its own index in memory)
+def fulltext_indexes():
+    if db.engine.dialect.name != 'mysql':
+        return []
+    messages = []
+    inspector = inspect(db.engine)
+    for table, name in FULLTEXT_INDEXES.items():
+        if table == ArchivedTasks.__tablename__ and retention.partitions(): # MySQL has no FULLTEXT on partitioned tables
+            continue
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            db.session.execute(text(f'CREATE FULLTEXT INDEX {name} ON {table} (task_name, task_description)'))
+            db.session.commit()
+            messages.append(f'{table}: created {name}')
+    return messages
+
+
+# Migration - the TaskStats summary table, counted from the task tables while it is empty
+def task_stats_table():
+    messages = []
+    if not inspect(db.engine).has_table(TaskStat.__tablename__):
+        TaskStat.__table__.create(db.engine)
+        messages.append('TaskStats: created')
+    if db.session.execute(select(TaskStat.source).limit(1)).first() is None:
+        result = task_stats.reconcile()
+        if result['groups']:
+            messages.append(f"TaskStats: counted {result['groups']} groups")
+    return messages
+
+
+# Migration - ArchivedTasks gains archived_at (existing rows get their due date, or now) and its index;
+# ArchiveSummaries holds the months compacted after the retention period
+def archive_retention():
+    messages = []
+    inspector = inspect(db.engine)
+    if 'archived_at' not in {column['name'] for column in inspector.get_columns('ArchivedTasks')}:
+        db.session.execute(text('ALTER TABLE ArchivedTasks ADD COLUMN archived_at DATETIME NULL'))
+        db.session.commit()
+        archive = ArchivedTasks.__table__
+        backfilled = 0
+        while True: # bounded transactions, like the task_due conversion
+            task_ids = db.session.execute(select(archive.c.task_id).where(archive.c.archived_at.is_(None)).limit(BATCH_SIZE)).scalars().all()
+            if not task_ids:
+                break
+            db.session.execute(update(archive).where(archive.c.task_id.in_(task_ids))
+                               .values(archived_at=func.coalesce(archive.c.task_due, datetime.now())))
+            db.session.commit()
+            backfilled += len(task_ids)
+        if db.engine.dialect.name == 'mysql':
+            db.session.execute(text('ALTER TABLE ArchivedTasks MODIFY archived_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP'))
+            db.session.commit()
+        messages.append(f'ArchivedTasks: added archived_at ({backfilled} rows backfilled)')
+    created = ensure_indexes(ArchivedTasks)
+    if created:
+        messages.append(f'ArchivedTasks: created {", ".join(created)}')
+    for model in (ArchiveSummary, CompactedPartition):
+        if not inspector.has_table(model.__tablename__):
+            model.__table__.create(db.engine)
+            messages.append(f'{model.__tablename__}: created')
+    return messages
+
+
+# Migration - GoalProgressLog and GoalRollups for goal progress history. History starts with the first
+# update after the upgrade: earlier progress was overwritten and is not known. A log created without
+# goal_owner gains it, filled in from the goals' current owners - entries of goals deleted before then
+# keep '' (their owner is not known), and rebuild() no longer counts them for anyone
+def goal_history_tables():
+    messages = []
+    inspector = inspect(db.engine)
+    for model in (GoalProgress, GoalRollup):
+        if not inspector.has_table(model.__tablename__):
+            model.__table__.create(db.engine)
+            messages.append(f'{model.__tablename__}: created')
+    if 'goal_owner' not in {column['name'] for column in inspector.get_columns(GoalProgress.__tablename__)}:
+        db.session.execute(text("ALTER TABLE GoalProgressLog ADD COLUMN goal_owner VARCHAR(255) NOT NULL DEFAULT ''"))
+        db.session.commit()
+        owner = select(Goal.goal_owner).where(Goal.goal_id == GoalProgress.goal_id).scalar_subquery()
+        last = db.session.execute(select(func.max(GoalProgress.entry_id))).scalar() or 0
+        backfilled = 0
+        for start in range(0, last, BATCH_SIZE): # bounded transactions, like the other backfills
+            backfilled += db.session.execute(
+                update(GoalProgress).where(GoalProgress.entry_id > start, GoalProgress.entry_id <= start + BATCH_SIZE,
+                                           GoalProgress.goal_id.in_(select(Goal.goal_id)))
+                .values(goal_owner=owner).execution_options(synchronize_session=False)).rowcount
+            db.session.commit()
+        messages.append(f'GoalProgressLog: added goal_owner ({backfilled} rows backfilled)')
+    return messages
+
+
+# Function to rebuild ArchivedTasks from the model where the table cannot be altered to gain a key (SQLite):
+# the old table is renamed, its rows copied into a new one in archiving order (a_id follows it), then dropped.
+# One transaction - a failure leaves the old table as it was
+def _rebuild_archive():
+    inspector = inspect(db.engine)
+    old_indexes = [index['name'] for index in inspector.get_indexes(ArchivedTasks.__tablename__)]
+    archive = ArchivedTasks.__table__
+    names = ', '.join(column.name for column in archive.columns if column.name != 'a_id')
+    with db.engine.begin() as connection:
+        connection.execute(text('ALTER TABLE ArchivedTasks RENAME TO ArchivedTasks_old'))
+        for name in old_indexes: # index names are per database on SQLite - free them for the new table
+            connection.execute(text(f'DROP INDEX {name}'))
+        archive.create(connection)
+        copied = connection.execute(text(f'INSERT INTO ArchivedTasks ({names}) SELECT {names} FROM ArchivedTasks_old '
+                                         'ORDER BY archived_at, task_id')).rowcount
+        connection.execute(text('DROP TABLE ArchivedTasks_old'))
+    return copied
+
+
+# Migration - ArchivedTasks gets its own key (a_id, as in manager.sql) where it was created from the models
+# with task_id as its key: ids are handed out again after the highest tasks are archived (SQLite, and MySQL
+# 5.7 after a restart), and archiving such a task would fail on the duplicate key on every run
+def archive_surrogate_key():
+    messages = []
+    if 'a_id' not in {column['name'] for column in inspect(db.engine).get_columns(ArchivedTasks.__tablename__)}:
+        db.session.commit() # nothing of the session's may hold the table during the rebuild
+        if db.engine.dialect.name != 'mysql':
+            return [f'ArchivedTasks: rebuilt with an a_id key ({_rebuild_archive()} rows copied)']
+        primary_key = ', '.join(['a_id'] + (['archived_at'] if retention.partitions() else [])) # partition column in every unique key
+        db.session.execute(text('ALTER TABLE ArchivedTasks DROP PRIMARY KEY, '
+                                f'ADD COLUMN a_id INTEGER NOT NULL AUTO_INCREMENT FIRST, ADD PRIMARY KEY ({primary_key})'))
+        messages.append('ArchivedTasks: added a_id key')
+    created = ensure_indexes(ArchivedTasks)
+    if created:
+        messages.append(f'ArchivedTasks: created {", ".join(created)}')
+    return messages
+
+
+# Migrations in the order they are applied - each one is safe to run again
+MIGRATIONS = [drop_legacy_archiving, task_due_to_datetime, category_registry, fulltext_indexes, archive_retention, archive_surrogate_key, task_stats_table, goal_history_tables]
+
+
+# Function to bring an existing database up to date with the models
+def upgrade():
+    messages = []
+    for migration in MIGRATIONS:
+        messages.extend(migration() or [f'{migration.__name__}: up to date'])
+    return messages
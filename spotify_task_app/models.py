@@ -1,3 +1,4 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy # manages DB interactions
 from sqlalchemy.orm import DeclarativeBase # class to define models in SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -32,9 +33,18 @@ class Task(db.Model):
     task_description = db.Column(db.Text, nullable=True)
     task_owner = db.Column(db.String(255), nullable=True)
     task_tag = db.Column(db.Enum('cleaning', 'cooking', 'shopping', 'gardening', 'laundry', 'DIY', 'finance', 'home', 'pets', 'childcare')) # predefined choices
-    task_due = db.Column(db.String(100), nullable=True)
+    task_due = db.Column(db.DateTime, nullable=True) # DATETIME, matches manager.sql
     task_status = db.Column(db.Enum('New', 'In Progress', 'Completed')) # predefined choices
 
+    # indexes backing the keyset-paginated overview (sort key + id, filter columns first)
+    __table_args__ = (
+        db.Index('ix_tasks_due_id', 'task_due', 'task_id'),
+        db.Index('ix_tasks_status_id', 'task_status', 'task_id'),
+        db.Index('ix_tasks_tag_due_id', 'task_tag', 'task_due', 'task_id'),
+        db.Index('ix_tasks_owner_due_id', 'task_owner', 'task_due', 'task_id'),
+        db.Index('ix_tasks_status_due', 'task_status', 'task_due'), # due today/overdue/upcoming range queries
+    )
+
 # Goal model - includes columns with constraints
 class Goal(db.Model):
     __tablename__ = 'Goals' # table in the DB
@@ -47,11 +57,80 @@ class Goal(db.Model):
 # Archived Tasks model - for completed and archived tasks
 class ArchivedTasks(db.Model):
     __tablename__ = 'ArchivedTasks'
-    task_id = db.Column(db.Integer, primary_key=True)
+    a_id = db.Column(db.Integer, primary_key=True) # own key, as in manager.sql - a task id can be handed out again once its task is archived
+    task_id = db.Column(db.Integer, nullable=True) # id the task had in Tasks
     task_name = db.Column(db.String(255), nullable=False)
     task_description = db.Column(db.Text, nullable=True)
     task_owner = db.Column(db.String(255), nullable=True)
     task_tag = db.Column(db.Enum('cleaning', 'cooking', 'shopping', 'gardening', 'laundry', 'DIY', 'finance', 'home', 'pets', 'childcare'))
-    task_due = db.Column(db.String(100), nullable=True)
+    task_due = db.Column(db.DateTime, nullable=True)
     task_status = db.Column(db.Enum('Completed')) # only completed tasks can be archived
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.now) # archive months (partitions on MySQL) and retention
+
+    # indexes backing the keyset-paginated archive overview - ties are broken on a_id, as task ids can repeat
+    __table_args__ = (
+        db.Index('ix_archived_due_id', 'task_due', 'a_id'),
+        db.Index('ix_archived_tag_due_id', 'task_tag', 'task_due', 'a_id'),
+        db.Index('ix_archived_owner_due_id', 'task_owner', 'task_due', 'a_id'),
+        db.Index('ix_archived_at_id', 'archived_at', 'a_id'), # one month of the archive, and retention
+        db.Index('ix_archived_task_id', 'task_id', 'a_id'), # archived tasks by their task id, and the id order
+    )
+
+# Archive summary model - archived tasks per month, tag and owner, for months compacted after the retention period (retention.py)
+class ArchiveSummary(db.Model):
+    __tablename__ = 'ArchiveSummaries'
+    month = db.Column(db.String(7), primary_key=True) # YYYY-MM of archived_at
+    task_tag = db.Column(db.String(20), primary_key=True) # '' when the task had no tag
+    task_owner = db.Column(db.String(255), primary_key=True) # '' for unclaimed tasks
+    task_count = db.Column(db.Integer, nullable=False, default=0)
+
+# Compacted partition model - archive partitions whose rows are counted in ArchiveSummaries, written with the
+# counts so a partition whose DROP failed is dropped on the next run without being counted again (retention.py)
+class CompactedPartition(db.Model):
+    __tablename__ = 'CompactedPartitions'
+    partition_name = db.Column(db.String(16), primary_key=True) # pYYYYMM
+    compacted_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+# Tag model - Spotify categories, one /home_page/<tag_name> page each
+class Tag(db.Model):
+    __tablename__ = 'Tags'
+    tag_id = db.Column(db.Integer, primary_key=True)
+    tag_name = db.Column(db.String(255))
+
+# Playlist model - playlists and artists (albums) listed on a category page, in p_id order
+class Playlist(db.Model):
+    __tablename__ = 'Playlists'
+    p_id = db.Column(db.Integer, primary_key=True)
+    p_name = db.Column(db.String(255))
+    p_tag = db.Column(db.String(255)) # Tags.tag_name
+    p_uri = db.Column(db.String(255)) # spotify:playlist:... or spotify:artist:...
+
+# Task statistics model - number of tasks per group, kept up to date by every task write (task_stats.py)
+class TaskStat(db.Model):
+    __tablename__ = 'TaskStats'
+    source = db.Column(db.String(10), primary_key=True) # 'tasks' or 'archive'
+    task_tag = db.Column(db.String(20), primary_key=True) # '' when the task has no tag
+    task_status = db.Column(db.String(20), primary_key=True)
+    task_owner = db.Column(db.String(255), primary_key=True) # '' for unclaimed tasks
+    due_day = db.Column(db.String(10), primary_key=True) # YYYY-MM-DD for open tasks, '' otherwise (for overdue counts)
+    task_count = db.Column(db.Integer, nullable=False, default=0)
+
+# Goal progress log model - one narrow row per progress update, never changed once written (goal_history.py)
+class GoalProgress(db.Model):
+    __tablename__ = 'GoalProgressLog'
+    entry_id = db.Column(db.Integer, primary_key=True)
+    goal_id = db.Column(db.Integer, nullable=False)
+    goal_owner = db.Column(db.String(255), nullable=False, default='') # owner when logged - the rollups the entry counts in
+    logged_at = db.Column(db.Integer, nullable=False) # seconds since the epoch
+    progress = db.Column(db.SmallInteger, nullable=False) # goal_history.PROGRESS_CODES - 'Not Today' 0 to 'Achieved' 3
+    __table_args__ = (db.Index('ix_goal_log_goal', 'goal_id', 'logged_at'),)
 
+# Goal rollup model - progress updates per owner and day or week, added to as updates are logged (goal_history.py)
+class GoalRollup(db.Model):
+    __tablename__ = 'GoalRollups'
+    goal_owner = db.Column(db.String(255), primary_key=True)
+    period = db.Column(db.String(1), primary_key=True) # 'd' for a day, 'w' for a week starting on Monday
+    period_start = db.Column(db.Date, primary_key=True)
+    updates = db.Column(db.Integer, nullable=False, default=0) # progress updates logged
+    achieved = db.Column(db.Integer, nullable=False, default=0) # updates that were 'Achieved'
+    score = db.Column(db.Integer, nullable=False, default=0) # sum of the updates' progress codes
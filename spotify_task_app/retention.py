@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import select, delete, func, text, inspect
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, ArchivedTasks, ArchiveSummary, CompactedPartition
+import counters
+import listings
+import search
+
+logger = logging.getLogger(__name__)
+
+# Archive retention. ArchivedTasks rows are archived by month (archived_at); once a month is older than the
+# retention period its rows are rolled up into ArchiveSummaries (count per tag and owner) and deleted, so
+# the archive stops growing while dashboard totals keep counting them.
+# On MySQL the archive can be partitioned by month (partition-archive): queries for one month read one
+# partition, and compaction drops a whole partition instead of deleting its rows. MySQL cannot keep a
+# FULLTEXT index on a partitioned table, so archive search then uses search's in-memory index.
+# Other backends read a month as one range of the (archived_at, task_id) index
+
+BATCH_SIZE = 1000 # rows compacted per transaction (unpartitioned tables)
+MONTHS_AHEAD = 3 # empty partitions kept ready for the coming months
+MAINTENANCE_INTERVAL = 86400 # seconds between scheduled compaction / partition runs
+FUTURE_PARTITION = 'pfuture' # catches rows beyond the last month partition
+
+
+# Running totals for compaction, reported by the CLI command and the metrics endpoint
+class RetentionStats:
+    def __init__(self):
+        self.runs = 0
+        self.rows = 0 # archived tasks rolled up into summaries
+        self.partitions_dropped = 0
+        self.errors = 0
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        with self._lock:
+            self.runs += 1
+            self.rows += result['rows']
+            self.partitions_dropped += result['partitions_dropped']
+            self.last_run = result
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def as_dict(self):
+        return {'runs': self.runs, 'rows': self.rows, 'partitions_dropped': self.partitions_dropped,
+                'errors': self.errors, 'last_run': self.last_run}
+
+
+stats = RetentionStats()
+
+
+def _add_months(start, months):
+    month = start.year * 12 + start.month - 1 + months
+    return start.replace(year=month // 12, month=month % 12 + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+# Function to return the start of the oldest month kept - rows archived before it are compacted
+def cutoff(months, now=None):
+    return _add_months(now or datetime.now(), -months)
+
+
+def _partition_name(start):
+    return start.strftime('p%Y%m')
+
+
+# Function to list the month partitions of the archive as {name: start of month} - empty when it is not partitioned
+def partitions():
+    if db.engine.dialect.name != 'mysql':
+        return {}
+    names = db.session.execute(text(
+        'SELECT PARTITION_NAME FROM information_schema.PARTITIONS '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL'),
+        {'table': ArchivedTasks.__tablename__}).scalars()
+    return {name: datetime.strptime(name, 'p%Y%m') for name in names if name != FUTURE_PARTITION}
+
+
+def _partition_list(months):
+    return ', '.join([f"PARTITION {_partition_name(start)} VALUES LESS THAN (TO_DAYS('{_add_months(start, 1):%Y-%m-%d}'))"
+                      for start in months] + [f'PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE'])
+
+
+# Function to work out the DDL that partitions the archive by month up to months_ahead months from now, or
+# adds the months missing at the end of an already partitioned archive. existing is partitions(), oldest is
+# the earliest archived_at, primary_key and fulltext the archive's primary key columns and FULLTEXT index names
+def partition_statements(existing, oldest, primary_key, fulltext=(), months_ahead=MONTHS_AHEAD, now=None):
+    last = _add_months(now or datetime.now(), months_ahead)
+    table = ArchivedTasks.__tablename__
+    if existing:
+        start = _add_months(max(existing.values()), 1)
+        months = []
+        while start <= last:
+            months.append(start)
+            start = _add_months(start, 1)
+        if not months:
+            return []
+        return [f'ALTER TABLE {table} REORGANIZE PARTITION {FUTURE_PARTITION} INTO ({_partition_list(months)})']
+
+    start = _add_months(oldest or now or datetime.now(), 0)
+    months = []
+    while start <= last:
+        months.append(start)
+        start = _add_months(start, 1)
+    statements = [f'ALTER TABLE {table} DROP INDEX {name}' for name in fulltext] # not allowed on partitioned tables
+    if 'archived_at' not in primary_key: # every unique key of a partitioned table must include the partition column
+        statements.append(f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY ({', '.join(list(primary_key) + ['archived_at'])})")
+    statements.append(f'ALTER TABLE {table} PARTITION BY RANGE (TO_DAYS(archived_at)) ({_partition_list(months)})')
+    return statements
+
+
+# Function to return the DDL for partition_statements() as this database stands
+def partition_ddl(months_ahead=MONTHS_AHEAD, now=None):
+    table = ArchivedTasks.__tablename__
+    existing = partitions()
+    inspector = inspect(db.engine)
+    oldest = db.session.execute(select(func.min(ArchivedTasks.archived_at))).scalar() if not existing else None
+    fulltext = [index['name'] for index in inspector.get_indexes(table) if index['name'] == search.FULLTEXT_INDEXES[table]]
+    primary_key = inspector.get_pk_constraint(table)['constrained_columns']
+    return partition_statements(existing, oldest, primary_key, fulltext, months_ahead, now)
+
+
+# Function to add counts ({(month, tag, owner): count}) to ArchiveSummaries, inside the caller's transaction
+def _summarise(counts):
+    for (month, tag, owner), count in counts.items():
+        counters.add(ArchiveSummary, {'month': month, 'task_tag': tag, 'task_owner': owner}, {'task_count': count})
+
+
+def _compact_rows(before, batch_size):
+    archive = ArchivedTasks
+    compacted = 0
+    while True:
+        rows = db.session.execute(
+            select(archive.a_id, archive.task_id, archive.task_tag, archive.task_owner, archive.archived_at)
+            .where(archive.archived_at < before)
+            .order_by(archive.archived_at, archive.a_id) # (archived_at, a_id) index range
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            return compacted
+        _summarise(Counter((row.archived_at.strftime('%Y-%m'), row.task_tag or '', row.task_owner or '') for row in rows))
+        row_ids = [row.a_id for row in rows]
+        db.session.execute(delete(archive).where(archive.a_id.in_(row_ids))) # task ids may repeat in the archive
+        db.session.commit()
+        listings.bump(listings.ARCHIVE)
+        search.changed(ArchivedTasks, row_ids)
+        compacted += len(rows)
+        if len(rows) < batch_size:
+            return compacted
+
+
+# Each partition is counted and marked as compacted in one transaction, then dropped (DDL commits on its
+# own). A partition already marked - its DROP failed or the process stopped before it - is only dropped
+def _compact_partitions(expired):
+    archive = ArchivedTasks
+    compacted = 0
+    done = set(db.session.execute(select(CompactedPartition.partition_name)
+                                  .where(CompactedPartition.partition_name.in_(list(expired)))).scalars())
+    for name in sorted(expired, key=expired.get):
+        if name not in done:
+            counts = db.session.execute(text( # reads this partition only
+                f"SELECT DATE_FORMAT(archived_at, '%Y-%m'), task_tag, task_owner, COUNT(*) FROM {archive.__tablename__} PARTITION ({name}) "
+                'GROUP BY 1, 2, 3')).all()
+            _summarise(Counter({(month, tag or '', owner or ''): count for month, tag, owner, count in counts}))
+            db.session.add(CompactedPartition(partition_name=name))
+            db.session.commit()
+            compacted += sum(count for *_, count in counts)
+        db.session.execute(text(f'ALTER TABLE {archive.__tablename__} DROP PARTITION {name}'))
+    if expired:
+        listings.bump(listings.ARCHIVE)
+        search.reset(ArchivedTasks)
+    return compacted
+
+
+# Function to roll archived tasks older than months months into ArchiveSummaries and remove them.
+# Whole expired partitions are dropped; rows of an unpartitioned archive are deleted batch_size at a time.
+# Returns counts and timing
+def compact(months, now=None, batch_size=BATCH_SIZE):
+    started = time.perf_counter()
+    before = cutoff(months, now)
+    expired = {name: start for name, start in partitions().items() if _add_months(start, 1) <= before}
+    rows = _compact_partitions(expired) + _compact_rows(before, batch_size)
+    result = {'rows': rows, 'partitions_dropped': len(expired), 'before': before.strftime('%Y-%m'),
+              'seconds': time.perf_counter() - started}
+    stats.record(result)
+    if rows:
+        logger.info('Compacted %d archived tasks from before %s', rows, result['before'])
+    return result
+
+
+# Function to return the compacted counts of one month, by tag and owner
+def month_summary(month):
+    return db.session.execute(select(ArchiveSummary.task_tag, ArchiveSummary.task_owner, ArchiveSummary.task_count)
+                              .where(ArchiveSummary.month == month)
+                              .order_by(ArchiveSummary.task_tag, ArchiveSummary.task_owner)).all()
+
+
+# Function to run the scheduled maintenance - partitions for the coming months (partitioned archives only)
+# and compaction when a retention period is set
+def maintain(months, now=None):
+    if partitions():
+        for statement in partition_ddl(now=now):
+            db.session.execute(text(statement))
+    if months:
+        compact(months, now)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+# Function to start the scheduled maintenance once per process (a daemon thread)
+def start(app, interval, months):
+    global _worker
+    if _worker is not None: # already running - checked on every request, so kept lock-free
+        return
+    with _worker_lock:
+        if _worker is not None or not interval:
+            return
+        def run():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        maintain(months)
+                    except SQLAlchemyError as e:
+                        db.session.rollback()
+                        stats.record_error()
+                        logger.error('Archive maintenance failed: %s', e)
+                    finally:
+                        db.session.remove()
+        _worker = threading.Thread(target=run, name='archive-retention', daemon=True)
+        _worker.start()
@@ -0,0 +1,358 @@
+import bisect
+import heapq
+import logging
+import re
+import threading
+import time
+from sqlalchemy import select, inspect
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.mysql import match
+from models import db, Task, ArchivedTasks
+from utils import filter_tasks
+from cache import Cache, MISSING
+import listings
+
+logger = logging.getLogger(__name__)
+
+# Full-text search over task names and descriptions, in Tasks and ArchivedTasks.
+# On MySQL a table is searched through its FULLTEXT index (created by `flask --app app upgrade-db`).
+# A table without one (SQLite, or a partitioned archive - MySQL cannot have both) is searched through
+# an inverted index kept in memory: built on the first search, then kept up to date by changed(), which
+# every write path calls after committing. That index is per process: changed() also appends the row ids
+# a write touched to a change log per table, and before a search each process applies the entries it has
+# not seen yet, re-reading only those rows - so other processes' edits and deletes cost what they changed.
+# The log is shared between processes through Redis (CACHE_REDIS_URL, like the listing cache) - without it
+# each process only sees its own edits and deletes (new rows are still caught up).
+# A query on a FULLTEXT index that fails (e.g. the index was dropped by partitioning the archive) makes
+# the backends be checked again. Either way a search costs the number of matching rows, not the size of the tables
+
+MIN_TOKEN = 3 # shorter words are not indexed - the same as InnoDB's default innodb_ft_min_token_size
+BATCH_SIZE = 1000 # rows read per query while building the in-memory index
+FULLTEXT_INDEXES = {'Tasks': 'ft_tasks_text', 'ArchivedTasks': 'ft_archived_text'}
+TABLES = {'tasks': Task, 'archive': ArchivedTasks} # search result 'table' -> model
+CHANGE_LOG_TTL = 3600 # seconds a change log entry is kept
+CHANGE_LOG_LIMIT = 1000 # changes applied one by one - an index further behind re-reads the table
+CHANGE_LOG_WAIT = 5.0 # seconds a change number may go without its entry (being written) before the table is re-read
+NEW_ROWS, RELOAD = 'new', 'reload' # change log entries besides row id lists - rows added, rows removed in bulk
+RESULT_COLUMNS = ('task_id', 'task_name', 'task_description', 'task_owner', 'task_tag', 'task_due', 'task_status')
+ARCHIVED_OPTIONS = {'include': ('tasks', 'archive'), 'exclude': ('tasks',), 'only': ('archive',)} # archived= -> tables searched
+NAME_WEIGHT = 2 # a word in the name counts for more than one in the description
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(value):
+    return {word for word in _WORD.findall((value or '').lower()) if len(word) >= MIN_TOKEN}
+
+
+def _kind(model):
+    return 'archive' if model is ArchivedTasks else 'tasks'
+
+
+# Change log - per table a counter of changes, and per change number the row ids it touched
+changes = Cache(listings.backend, ttl=CHANGE_LOG_TTL, namespace='search-changes')
+
+
+# Function to return the number of a table's last change - None when the cache cannot be reached. A missing
+# counter (evicted, Redis restarted) starts from the time, far from any number an index has applied
+def _change_number(kind):
+    current = changes.get(kind)
+    if current is MISSING:
+        current = changes.incr(kind, time.time_ns() // 1000)
+    return current
+
+
+# Function to append a change to a table's log - returns its number, None when the cache cannot be reached
+def _log_change(kind, entry):
+    number = changes.incr(kind, time.time_ns() // 1000)
+    if number is not None:
+        changes.set(f'{kind}:{number}', entry)
+    return number
+
+
+# Column identifying a row of a table - task ids repeat in the archive (a reused id), so it uses a_id
+def _row_id(model):
+    return model.a_id if model is ArchivedTasks else model.task_id
+
+
+# In-memory inverted index - word -> postings {(table, row id)}, plus per row its name/description
+# words and filter columns (to remove its postings on change, filter, and score).
+# Every word of a query matches as a prefix (like MySQL's word* in boolean mode), through the sorted vocabulary
+class InvertedIndex:
+    def __init__(self):
+        self.build_seconds = 0.0
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.built = False
+        self._postings = {}
+        self._vocabulary = [] # sorted words, for prefix lookups
+        self._rows = {} # (table, row id) -> (name words, description words, tag, status, owner)
+        self._max_id = {} # table -> highest row id indexed, to catch up on new rows
+        self._applied = {} # table -> number of the last logged change the indexed rows include
+        self._waiting = {} # (table, change number) -> when its missing entry was first looked for
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def words(self):
+        return len(self._postings)
+
+    def _add(self, key, row):
+        name_words, description_words = tokenize(row.task_name), tokenize(row.task_description)
+        self._rows[key] = (name_words, description_words, row.task_tag, row.task_status, row.task_owner)
+        for word in name_words | description_words:
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = set()
+                bisect.insort(self._vocabulary, word)
+            postings.add(key)
+        self._max_id[key[0]] = max(self._max_id.get(key[0], 0), key[1])
+
+    def _remove(self, key):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        for word in row[0] | row[1]:
+            postings = self._postings[word]
+            postings.discard(key)
+            if not postings:
+                del self._postings[word]
+                del self._vocabulary[bisect.bisect_left(self._vocabulary, word)]
+        if key[1] >= self._max_id.get(key[0], 0): # the newest row - an id used again must count as new
+            self._max_id[key[0]] = max((row_id for kind, row_id in self._rows if kind == key[0]), default=0)
+
+    @staticmethod
+    def _columns(model):
+        return [_row_id(model).label('row_id')] + [getattr(model, name) for name in ('task_name', 'task_description', 'task_tag', 'task_status', 'task_owner')]
+
+    def _read(self, model, *conditions):
+        row_id = _row_id(model)
+        last_id = 0
+        while True:
+            rows = db.session.execute(select(*self._columns(model)).where(row_id > last_id, *conditions)
+                                      .order_by(row_id).limit(BATCH_SIZE)).all()
+            yield from rows
+            if len(rows) < BATCH_SIZE:
+                return
+            last_id = rows[-1].row_id
+
+    # Function to (re-)index every row of a table. The change number is read first, so a write committed
+    # while the rows are read is applied (again) by the next sync
+    def _load(self, kind, model):
+        for key in sorted(key for key in self._rows if key[0] == kind):
+            self._remove(key)
+        self._applied[kind] = _change_number(kind)
+        self._waiting = {waiting: since for waiting, since in self._waiting.items() if waiting[0] != kind}
+        for row in self._read(model):
+            self._add((kind, row.row_id), row)
+
+    # Function to index every row of the given tables ({kind: model}), in keyset batches
+    def build(self, tables=TABLES):
+        started = time.perf_counter()
+        with self.lock:
+            self._reset()
+            for kind, model in tables.items():
+                self._load(kind, model)
+            self.built = True
+        self.build_seconds = time.perf_counter() - started
+        logger.info('Search index built: %d tasks in %.2fs', len(self._rows), self.build_seconds)
+
+    # Function to index rows added since the last look (new ids only)
+    def catch_up(self, model):
+        kind = _kind(model)
+        with self.lock:
+            for row in self._read(model, _row_id(model) > self._max_id.get(kind, 0)):
+                self._add((kind, row.row_id), row)
+
+    # Function to bring a table up to date - applies the logged changes it has not seen (this process's and
+    # others'), re-reading the rows each one touched, then catches up new rows - always before a search (rows
+    # may be added without a log entry), otherwise only when a logged change added rows.
+    # The table is only re-read when the log cannot tell what changed (too far behind, expired, bulk removal)
+    def sync(self, model, new_rows=True):
+        kind = _kind(model)
+        with self.lock:
+            current, applied = _change_number(kind), self._applied.get(kind)
+            if current is not None and (applied is None or not 0 <= current - applied <= CHANGE_LOG_LIMIT):
+                return self._reload(kind, model)
+            for number in range(applied + 1, current + 1) if current is not None else ():
+                entry = changes.get(f'{kind}:{number}')
+                if entry is MISSING: # numbered by a writer that is still storing it - or expired
+                    since = self._waiting.setdefault((kind, number), time.monotonic())
+                    if time.monotonic() - since < CHANGE_LOG_WAIT:
+                        break
+                    entry = RELOAD
+                if entry == RELOAD:
+                    return self._reload(kind, model)
+                if entry == NEW_ROWS:
+                    new_rows = True
+                else:
+                    self.refresh(model, entry)
+                self._applied[kind] = number
+                self._waiting.pop((kind, number), None)
+            if new_rows:
+                self.catch_up(model)
+
+    def _reload(self, kind, model):
+        started = time.perf_counter()
+        self._load(kind, model)
+        logger.info('Search index: %s re-read in %.2fs', kind, time.perf_counter() - started)
+
+    # Function to re-read the given rows of a table (row ids) - changed rows are re-indexed, deleted ones removed
+    def refresh(self, model, row_ids):
+        kind = _kind(model)
+        with self.lock:
+            rows = {row.row_id: row for row in db.session.execute(select(*self._columns(model)).where(_row_id(model).in_(row_ids)))}
+            for row_id in row_ids:
+                self._remove((kind, row_id))
+                if row_id in rows:
+                    self._add((kind, row_id), rows[row_id])
+
+    def _matching(self, term):
+        position = bisect.bisect_left(self._vocabulary, term)
+        words = []
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(term):
+            words.append(self._vocabulary[position])
+            position += 1
+        return words
+
+    # Function to find rows containing every term (as a word prefix) - returns [(score, table, row id)], best first
+    def search(self, terms, kinds, tag=None, owner=None, status=None, limit=25):
+        with self.lock:
+            matched = {term: set(self._matching(term)) for term in terms}
+            candidates = None
+            for term in sorted(terms, key=lambda term: sum(len(self._postings[word]) for word in matched[term])):
+                found = set().union(*(self._postings[word] for word in matched[term]))
+                candidates = found if candidates is None else candidates & found
+                if not candidates:
+                    return []
+            results = []
+            for key in candidates:
+                name_words, description_words, row_tag, row_status, row_owner = self._rows[key]
+                if key[0] not in kinds or (tag and row_tag != tag) or (status and row_status != status) or (owner and row_owner != owner):
+                    continue
+                score = sum(NAME_WEIGHT * bool(name_words & matched[term]) + bool(description_words & matched[term]) for term in terms)
+                results.append((score, key[0] == 'tasks', key[1], key[0]))
+        return [(score, kind, row_id) for score, _, row_id, kind in heapq.nlargest(limit, results)]
+
+
+index = InvertedIndex()
+_backends = None # {table: 'fulltext' or 'index'}, decided on first use
+
+
+# Function to tell which backend searches each table - its MySQL FULLTEXT index when it has one, the in-memory index otherwise
+def backends():
+    global _backends
+    if _backends is None:
+        found = {}
+        if db.engine.dialect.name == 'mysql':
+            inspector = inspect(db.engine)
+            for kind, model in TABLES.items():
+                name = FULLTEXT_INDEXES[model.__tablename__]
+                found[kind] = 'fulltext' if name in {existing['name'] for existing in inspector.get_indexes(model.__tablename__)} else 'index'
+            if found['tasks'] == 'index':
+                logger.warning('No FULLTEXT index on Tasks - run flask --app app upgrade-db; searching in memory meanwhile')
+        _backends = {kind: found.get(kind, 'index') for kind in TABLES}
+    return _backends
+
+
+# Function to name the backend answering searches - 'fulltext', 'index', or 'mixed' when the tables differ
+def backend():
+    used = set(backends().values())
+    return used.pop() if len(used) == 1 else 'mixed'
+
+
+# Function to tell search that rows were removed in bulk (e.g. a dropped partition) - every process re-reads
+# the table (without a model, this process rebuilds its whole in-memory index) on its next search
+def reset(model=None):
+    with index.lock:
+        if model is None or _log_change(_kind(model), RELOAD) is None:
+            index.built = False
+
+
+# Function to check the tables' indexes again on the next search (and rebuild the in-memory index for them)
+def recheck():
+    global _backends
+    _backends = None
+    reset()
+
+
+def _fulltext(model, terms, tag, owner, status, limit):
+    relevance = match(model.task_name, model.task_description, against=' '.join(f'+{term}*' for term in terms)).in_boolean_mode()
+    stmt = filter_tasks(select(*(getattr(model, name) for name in RESULT_COLUMNS), relevance.label('score')).where(relevance),
+                        model, tag, owner, status)
+    return db.session.execute(stmt.order_by(relevance.desc(), model.task_id.desc()).limit(limit)).all()
+
+
+def _in_memory(kinds, terms, tag, owner, status, limit):
+    if not index.built:
+        index.build({kind: model for kind, model in TABLES.items() if backends()[kind] == 'index'})
+    for kind in kinds:
+        index.sync(TABLES[kind]) # rows written by another process
+    hits = index.search(terms, kinds, tag, owner, status, limit)
+    rows = {}
+    for kind in kinds:
+        ids = [row_id for _, hit_kind, row_id in hits if hit_kind == kind]
+        if ids:
+            model = TABLES[kind]
+            stmt = select(_row_id(model).label('row_id'), *(getattr(model, name) for name in RESULT_COLUMNS)).where(_row_id(model).in_(ids))
+            rows.update(((kind, row.row_id), row) for row in db.session.execute(stmt))
+    return [(score, kind, rows[(kind, row_id)]) for score, kind, row_id in hits if (kind, row_id) in rows]
+
+
+# Function to search task names and descriptions. archived is 'include', 'exclude' or 'only'.
+# Returns up to limit rows as dicts (with 'table': 'tasks' or 'archive', and 'score'), best match first.
+# When the tables use different backends each one's scores are scaled to its best match before merging.
+# A failed FULLTEXT query is retried once after checking the indexes again
+def search_tasks(query, tag=None, owner=None, status=None, archived='include', limit=25):
+    terms = sorted(tokenize(query))
+    if not terms:
+        return []
+    try:
+        return _search(terms, tag, owner, status, ARCHIVED_OPTIONS[archived], limit)
+    except SQLAlchemyError as e:
+        if 'fulltext' not in backends().values():
+            raise
+        db.session.rollback()
+        logger.warning('FULLTEXT search failed, checking the indexes again: %s', e)
+        recheck()
+        return _search(terms, tag, owner, status, ARCHIVED_OPTIONS[archived], limit)
+
+
+def _search(terms, tag, owner, status, kinds, limit):
+    fulltext = [kind for kind in kinds if backends()[kind] == 'fulltext']
+    in_memory = [kind for kind in kinds if backends()[kind] == 'index']
+    groups = []
+    if fulltext:
+        groups.append([(float(row.score), kind, row) for kind in fulltext for row in _fulltext(TABLES[kind], terms, tag, owner, status, limit)])
+    if in_memory:
+        groups.append(_in_memory(in_memory, terms, tag, owner, status, limit))
+    if len(groups) > 1:
+        groups = [[(score / max(best for best, _, _ in group), kind, row) for score, kind, row in group] for group in groups if group]
+    results = sorted((result for group in groups for result in group),
+                     key=lambda result: (result[0], result[1] == 'tasks', result[2].task_id), reverse=True)
+    return [dict({name: row._mapping[name] for name in RESULT_COLUMNS}, table=kind, score=score) for score, kind, row in results[:limit]]
+
+
+# Function to tell search that rows of a table changed (after the commit). row_ids are the rows (task_id,
+# a_id in the archive) that were added, updated or deleted; None means rows were only added.
+# Nothing to do for FULLTEXT; the change is logged for other processes even before this one's first search
+def changed(model, row_ids=None):
+    kind = _kind(model)
+    if _backends is not None and _backends[kind] != 'index':
+        return
+    with index.lock: # waits for a build in progress, which may already have read these rows
+        _log_change(kind, NEW_ROWS if row_ids is None else list(row_ids))
+        if not index.built:
+            return
+        try:
+            index.sync(model, new_rows=False) # looked for when a logged change added rows
+        except SQLAlchemyError as e: # the write itself succeeded - rebuild on the next search instead
+            db.session.rollback()
+            index.built = False
+            logger.error('Search index update failed, rebuilding on next search: %s', e)
+
+
+def stats():
+    return {'backend': backend() if _backends is not None else None, 'indexed_rows': len(index), 'words': index.words, 'build_seconds': index.build_seconds}
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from catalog import CATEGORIES, is_artist
+
+logger = logging.getLogger(__name__)
+
+# Offline copy of everything the category pages show - written by `flask --app app snapshot-catalog`
+# and served with CATALOG_SNAPSHOT set, so the pages need no Spotify call at all.
+# The file is compact JSON: a few KB that loads in well under a millisecond
+
+FORMAT = 1
+CHECK_INTERVAL = 5.0 # seconds between checks of the file for a newer snapshot
+
+
+def _album_key(uri, album_type='album'):
+    return f'{album_type}:{uri}'
+
+
+# Function to resolve every URI in categories ({name: [uri, ...]}) through catalog (which must not itself use a snapshot).
+# Returns the snapshot data and the URIs that could not be resolved
+def build(catalog, categories=CATEGORIES, deadline=30.0):
+    uris = list(dict.fromkeys(uri for category_uris in categories.values() for uri in category_uris))
+    playlist_uris = [uri for uri in uris if not is_artist(uri)]
+    playlists = {}
+    missing = []
+    for uri, result in zip(playlist_uris, catalog.playlists(playlist_uris, deadline=deadline)):
+        if result is None:
+            missing.append(uri)
+        else:
+            playlists[uri] = result
+
+    albums = {}
+    for uri in uris:
+        if not is_artist(uri):
+            continue
+        try:
+            albums[_album_key(uri)] = catalog.artist_albums(uri)
+        except Exception as e:
+            logger.warning('Spotify album lookup failed for %s: %s', uri, e)
+            missing.append(uri)
+
+    return {'format': FORMAT, 'created': time.time(), 'playlists': playlists, 'albums': albums}, missing
+
+
+# Function to write a snapshot atomically - written to a temporary file next to path and renamed over it,
+# so a reader only ever sees the old file or the complete new one
+def write(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.catalog-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            json.dump(data, out, separators=(',', ':'))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def load(path):
+    with open(path, encoding='utf-8') as snapshot_file:
+        data = json.load(snapshot_file)
+    if data.get('format') != FORMAT:
+        raise ValueError(f"unsupported snapshot format {data.get('format')!r}")
+    return data
+
+
+# Snapshot being served. Lookups check the file's modification time at most every check_interval
+# seconds; a changed file is loaded by the one request that noticed and swapped in with a single
+# assignment, so other requests keep reading the old data meanwhile. A file that is missing or
+# unreadable leaves the current data in place (lookups return None, the catalog goes to Spotify)
+class Snapshot:
+    def __init__(self, path, check_interval=CHECK_INTERVAL, clock=time.monotonic):
+        self.path = path
+        self.check_interval = check_interval
+        self.clock = clock # injectable for tests
+        self.loads = 0
+        self.load_errors = 0
+        self._data = {'created': None, 'playlists': {}, 'albums': {}}
+        self._signature = None # (mtime, size) of the loaded file
+        self._checked = clock()
+        self._lock = threading.Lock()
+        self.reload()
+
+    # Function to load the file if it changed since the last load - returns True when new data was swapped in
+    def reload(self):
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if signature == self._signature:
+                return False
+            data = load(self.path)
+        except (OSError, ValueError) as e:
+            self.load_errors += 1
+            logger.error('Catalog snapshot %s could not be loaded: %s', self.path, e)
+            return False
+        self._data = data
+        self._signature = signature
+        self.loads += 1
+        return True
+
+    def _maybe_reload(self):
+        now = self.clock()
+        if now - self._checked < self.check_interval or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked = now
+            self.reload()
+        finally:
+            self._lock.release()
+
+    # Name and link of a playlist, None when the snapshot does not have it
+    def playlist(self, uri):
+        self._maybe_reload()
+        return self._data['playlists'].get(uri)
+
+    # Albums of an artist, None when the snapshot does not have them
+    def albums(self, uri, album_type='album'):
+        self._maybe_reload()
+        return self._data['albums'].get(_album_key(uri, album_type))
+
+    def stats(self):
+        data = self._data
+        return {
+            'path': self.path,
+            'created': data['created'],
+            'age_seconds': time.time() - data['created'] if data['created'] else None,
+            'playlists': len(data['playlists']),
+            'albums': len(data['albums']),
+            'loads': self.loads,
+            'load_errors': self.load_errors
+        }
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from flask import session, redirect, url_for
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+from cache import MISSING
+
+logger = logging.getLogger(__name__)
+
+REFRESH_MARGIN = 300 # seconds before expiry a token is refreshed in the background (spotipy refreshes inline at 60)
+REFRESH_TIMEOUT = 5.0 # seconds a request waits for the refresh of an already expired token
+SESSION_KEY = 'token_info' # where FlaskSessionCacheHandler keeps the token
+
+
+# Refreshes Spotify access tokens off the request thread.
+# Refreshes run on a small pool with a separate SpotifyOAuth (in-memory cache handler, so a refresh never
+# touches a Flask session outside its request). Concurrent refreshes of the same token are coalesced
+# into one upstream call. Refreshed tokens are kept in a cache backend keyed by a hash of the refresh
+# token until the session's next request picks them up - with Redis, any worker process can pick them up
+class TokenRefresher:
+    def __init__(self, client_id, client_secret, redirect_uri, scope, backend, margin=REFRESH_MARGIN,
+                 timeout=REFRESH_TIMEOUT, max_workers=2):
+        self.oauth = SpotifyOAuth(client_id=client_id, client_secret=client_secret, redirect_uri=redirect_uri,
+                                  scope=scope, cache_handler=MemoryCacheHandler())
+        self.scope = set(self.oauth.scope.split()) if self.oauth.scope else set()
+        self.backend = backend
+        self.margin = margin
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='spotify-refresh')
+        self.refreshes = 0 # upstream refresh calls made
+        self.failures = 0
+        self._inflight = {} # refresh key -> Future
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(refresh_token):
+        return 'spotify-token:' + hashlib.sha256(refresh_token.encode()).hexdigest()
+
+    def _refresh(self, refresh_token, key):
+        try:
+            token_info = self.oauth.refresh_access_token(refresh_token)
+            with self._lock:
+                self.refreshes += 1
+            # kept until shortly after the new token expires - the session has no use for it after that
+            self.backend.set(key, token_info, ttl=max(int(token_info['expires_at'] - time.time()), 60))
+            return token_info
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    # Function to start a refresh, or join the one already running for the same token
+    def refresh_async(self, refresh_token):
+        key = self._key(refresh_token)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self.executor.submit(self._refresh, refresh_token, key)
+                self._inflight[key] = future
+            return future
+
+    # Function to return a token refreshed in the background since the session last saw it (None if there is none)
+    def refreshed(self, refresh_token):
+        token_info = self.backend.get(self._key(refresh_token))
+        return None if token_info is MISSING else token_info
+
+    # Function to make sure the session holds a usable token. Until the token is within margin seconds
+    # of expiry this only compares its stored expiry time - no I/O. Near expiry it swaps in a token
+    # refreshed in the background, or starts that refresh; only an already expired token makes the
+    # request wait for the (shared) refresh. Returns False when the user has to authorise again
+    def ensure_fresh(self, session):
+        token_info = session.get(SESSION_KEY)
+        if not token_info or 'expires_at' not in token_info or not self.scope <= set(token_info.get('scope', '').split()):
+            return False
+        if not token_info.get('refresh_token'): # cannot be refreshed - usable until spotipy would consider it expired
+            return token_info['expires_at'] - time.time() > 60
+        remaining = token_info['expires_at'] - time.time()
+        if remaining > self.margin: # the common case - nothing but this comparison
+            return True
+        refreshed = self.refreshed(token_info['refresh_token'])
+        if refreshed is not None and refreshed['expires_at'] > token_info['expires_at']:
+            session[SESSION_KEY] = refreshed # picked up from a background refresh
+            return True
+        future = self.refresh_async(token_info['refresh_token'])
+        if remaining > 60: # still valid for spotipy - this request goes ahead, the next one gets the new token
+            return True
+        try:
+            session[SESSION_KEY] = future.result(timeout=self.timeout)
+            return True
+        except Exception as e:
+            logger.warning('Spotify token refresh failed: %s', e)
+            return False
+
+    def stats(self):
+        return {'refreshes': self.refreshes, 'failures': self.failures, 'in_flight': len(self._inflight)}
+
+
+# Decorator for routes that call Spotify - sends the user to Spotify's authorisation page when the
+# session has no usable token, otherwise makes sure the token will not need an inline refresh.
+# offline(**view arguments) tells when the page can be served without Spotify (from the catalog
+# snapshot) - only the app login is checked then, not the token, so the page keeps working while Spotify is down
+def spotify_login_required(refresher, authorize_url, offline=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if offline is not None and offline(**kwargs):
+                if 'username' not in session:
+                    return redirect(url_for('login'))
+                return view(*args, **kwargs)
+            if not refresher.ensure_fresh(session):
+                return redirect(authorize_url())
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import select, delete, func
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Task, ArchivedTasks, TaskStat, ArchiveSummary
+import counters
+
+logger = logging.getLogger(__name__)
+
+# Task counts for the dashboard, per group of (table, tag, status, owner, due day) in the TaskStats table.
+# Every path that writes tasks applies the change in counts in the same transaction as the write, so the
+# dashboard reads a few hundred group rows however many tasks there are. The due day is only kept for
+# open tasks, which makes overdue counts a sum over groups too. reconcile() recounts from the task
+# tables and corrects any drift (writes made outside the app, crashes between statements)
+
+RECONCILE_INTERVAL = 3600 # seconds between scheduled reconciliations
+SOURCES = {'tasks': Task, 'archive': ArchivedTasks} # TaskStats.source -> table counted
+
+
+# Running totals for reconciliation, reported by the CLI command and the metrics endpoint
+class ReconcileStats:
+    def __init__(self):
+        self.runs = 0
+        self.corrections = 0 # groups whose stored count was wrong
+        self.errors = 0
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        with self._lock:
+            self.runs += 1
+            self.corrections += result['corrected']
+            self.last_run = result
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def as_dict(self):
+        return {'runs': self.runs, 'corrections': self.corrections, 'errors': self.errors, 'last_run': self.last_run}
+
+
+stats = ReconcileStats()
+
+
+def _day(value):
+    if value is None:
+        return ''
+    return value[:10] if isinstance(value, str) else value.strftime('%Y-%m-%d')
+
+
+# Function to return the group a task counts in - row is a task object, a row tuple or a dict of Tasks values
+def group_of(row, source='tasks'):
+    get = row.get if isinstance(row, dict) else lambda name: getattr(row, name, None)
+    status = get('task_status') or ''
+    due_day = _day(get('task_due')) if source == 'tasks' and status != 'Completed' else ''
+    return source, get('task_tag') or '', status, get('task_owner') or '', due_day
+
+
+# Function to add deltas ({group: change in count}) to the stored counts. Runs inside the caller's
+# transaction and does not commit, so the counts change exactly when the tasks do
+def apply(deltas):
+    for group, delta in deltas.items():
+        if not delta:
+            continue
+        source, tag, status, owner, due_day = group
+        counters.add(TaskStat, {'source': source, 'task_tag': tag, 'task_status': status, 'task_owner': owner, 'due_day': due_day},
+                     {'task_count': delta})
+
+
+# Function to count new tasks (before the commit that adds them)
+def added(rows, source='tasks'):
+    apply(Counter(group_of(row, source) for row in rows))
+
+
+# Function to read the tasks about to be updated, locking their rows until the commit -
+# {task_id: the values that decide its group}
+def locked(task_ids, *conditions):
+    rows = db.session.execute(select(Task.task_id, Task.task_tag, Task.task_status, Task.task_owner, Task.task_due)
+                              .where(Task.task_id.in_(task_ids), *conditions).with_for_update()).all()
+    return {row.task_id: row._asdict() for row in rows}
+
+
+# Function to count updated tasks (before the commit) - before is what locked() returned ahead of the
+# update, values the columns the update set on every row. The new groups follow from the two, so the rows
+# are not read again; without values (an update that differs per row) they are
+def updated(before, values=None):
+    if not before:
+        return
+    after = {task_id: {**row, **values} for task_id, row in before.items()} if values is not None else locked(list(before))
+    deltas = Counter()
+    for row in before.values():
+        deltas[group_of(row)] -= 1
+    for row in after.values():
+        deltas[group_of(row)] += 1
+    apply(deltas)
+
+
+# Function to count claimed tasks (before the commit) - rows are the claimed tasks' task_tag, task_status and
+# task_due, with a count column when grouped. A claim only takes tasks without an owner, so each one moves
+# from owner '' to owner and the pre-image is not needed
+def claimed(rows, owner):
+    deltas = Counter()
+    for row in rows:
+        values = dict(row._asdict())
+        count = values.pop('count', 1)
+        deltas[group_of({**values, 'task_owner': ''})] -= count
+        deltas[group_of({**values, 'task_owner': owner})] += count
+    apply(deltas)
+
+
+# Function to move the counts of a batch of completed tasks from Tasks to ArchivedTasks - one grouped
+# read of the batch's rows
+def archived(task_ids):
+    deltas = Counter()
+    rows = db.session.execute(select(Task.task_tag, Task.task_owner, func.count())
+                              .where(Task.task_id.in_(task_ids))
+                              .group_by(Task.task_tag, Task.task_owner)).all()
+    for tag, owner, count in rows:
+        deltas[group_of({'task_tag': tag, 'task_owner': owner, 'task_status': 'Completed'})] -= count
+        deltas[group_of({'task_tag': tag, 'task_owner': owner, 'task_status': 'Completed'}, 'archive')] += count
+    apply(deltas)
+
+
+# Function to count every group from the task tables - one grouped query per table. Archived tasks
+# compacted after the retention period are counted from their monthly summaries
+def count_groups():
+    counts = Counter()
+    for source, model in SOURCES.items():
+        columns = [model.task_tag, model.task_status, model.task_owner]
+        if source == 'tasks':
+            columns.append(func.date(model.task_due).label('task_due'))
+        for row in db.session.execute(select(*columns, func.count().label('tasks')).group_by(*columns)):
+            counts[group_of(row, source)] += row.tasks
+    compacted = select(ArchiveSummary.task_tag, ArchiveSummary.task_owner, func.sum(ArchiveSummary.task_count))
+    for tag, owner, count in db.session.execute(compacted.group_by(ArchiveSummary.task_tag, ArchiveSummary.task_owner)):
+        counts[group_of({'task_tag': tag, 'task_owner': owner, 'task_status': 'Completed'}, 'archive')] += int(count)
+    return counts
+
+
+# Function to recount every group and correct the stored counts that are wrong. The stored rows are
+# locked first, so writes that would change them wait until the corrected counts are committed.
+# Returns the number of groups and of corrected groups
+def reconcile():
+    started = time.perf_counter()
+    stored = {(row.source, row.task_tag, row.task_status, row.task_owner, row.due_day): row.task_count
+              for row in db.session.execute(select(TaskStat).with_for_update()).scalars()}
+    actual = count_groups()
+    corrected = 0
+    for group in stored.keys() - actual.keys():
+        source, tag, status, owner, due_day = group
+        db.session.execute(delete(TaskStat).where(TaskStat.source == source, TaskStat.task_tag == tag, TaskStat.task_status == status,
+                                                  TaskStat.task_owner == owner, TaskStat.due_day == due_day))
+        corrected += stored[group] != 0
+    for group, count in actual.items():
+        if stored.get(group) != count:
+            source, tag, status, owner, due_day = group
+            db.session.merge(TaskStat(source=source, task_tag=tag, task_status=status, task_owner=owner, due_day=due_day, task_count=count))
+            corrected += 1
+    db.session.commit()
+    result = {'groups': len(actual), 'corrected': corrected, 'seconds': time.perf_counter() - started}
+    stats.record(result)
+    if corrected:
+        logger.warning('Task statistics: corrected %d of %d groups', corrected, len(actual))
+    return result
+
+
+# Function to summarise the stored counts for the dashboard - reads the group rows only, plus the tasks due
+# earlier today (a range of the due date index). Open, overdue, completed and archived counts per tag and
+# owner (and overall) with the completion rate - completed or archived out of all tasks - and counts per status
+def summary(now=None):
+    now = now or datetime.now()
+    today = now.strftime('%Y-%m-%d')
+    totals = {'tag': {}, 'owner': {}, 'status': Counter()}
+    overall = Counter()
+
+    def add(dimension, name, field, count):
+        entry = totals[dimension].setdefault(name, Counter())
+        entry[field] += count
+
+    for row in db.session.execute(select(TaskStat).where(TaskStat.task_count != 0)).scalars():
+        if row.source == 'archive':
+            fields = ['archived']
+        elif row.task_status == 'Completed':
+            fields = ['completed'] # completed, not archived yet
+        else:
+            fields = ['open'] + (['overdue'] if row.due_day and row.due_day < today else [])
+        for field in fields:
+            add('tag', row.task_tag, field, row.task_count)
+            add('owner', row.task_owner, field, row.task_count)
+            overall[field] += row.task_count
+        if row.source == 'tasks':
+            totals['status'][row.task_status] += row.task_count
+
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    due_earlier_today = select(Task.task_tag, Task.task_owner, func.count()).where(
+        Task.task_status != 'Completed', Task.task_due >= start_of_day, Task.task_due < now).group_by(Task.task_tag, Task.task_owner)
+    for tag, owner, count in db.session.execute(due_earlier_today):
+        add('tag', tag or '', 'overdue', count)
+        add('owner', owner or '', 'overdue', count)
+        overall['overdue'] += count
+
+    def finish(entry):
+        done = entry['archived'] + entry['completed']
+        total = done + entry['open']
+        return {'open': entry['open'], 'overdue': entry['overdue'], 'completed': entry['completed'], 'archived': entry['archived'],
+                'completion_rate': done / total if total else None}
+
+    return {
+        'overall': finish(overall),
+        'by_status': dict(totals['status']),
+        'by_tag': {name: finish(entry) for name, entry in sorted(totals['tag'].items())},
+        'by_owner': {name: finish(entry) for name, entry in sorted(totals['owner'].items())}
+    }
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+# Function to start the scheduled reconciliation once per process (a daemon thread)
+def start(app, interval=RECONCILE_INTERVAL):
+    global _worker
+    if _worker is not None: # already running - checked on every request, so kept lock-free
+        return
+    with _worker_lock:
+        if _worker is not None or not interval:
+            return
+        def run():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        reconcile()
+                    except SQLAlchemyError as e:
+                        db.session.rollback()
+                        stats.record_error()
+                        logger.error('Task statistics reconciliation failed: %s', e)
+                    finally:
+                        db.session.remove()
+        _worker = threading.Thread(target=run, name='task-stats', daemon=True)
+        _worker.start()
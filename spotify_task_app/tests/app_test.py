@@ -1,5 +1,11 @@
+import io
 import unittest
-from app import app, db, Task, Goal, get_token
+from datetime import datetime, timedelta
+from app import app, db, Task, Goal, ArchivedTasks, get_token
+from archiver import archive_completed
+from bulk import import_tasks, export_tasks
+from utils import get_tasks_page, get_archived_tasks_page, get_overdue_tasks, get_tasks_due_today, get_tasks_due_next, claim_tasks
+import listings
 from flask import url_for
 
 # Test case class for Flask app testing
@@ -26,7 +32,7 @@ class TestApp(unittest.TestCase):
             task_description='Test Description',
             task_owner='Test Owner',
             task_tag='cooking',
-            task_due='2024-08-25 18:00:00',
+            task_due=datetime(2024, 8, 25, 18, 0),
             task_status='New'
         )
 
@@ -40,6 +46,7 @@ class TestApp(unittest.TestCase):
         db.session.add(test_task)
         db.session.add(test_goal)
         db.session.commit()
+        listings.pages.clear() # test data is written directly, not through the app's write paths
 
     def tearDown(self): # for DB and app context clean up, called automatically after each test method to reset env
         db.session.remove() # clears current session state
@@ -69,6 +76,51 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'Tasks Overview', response.data)
 
+    def test_overview_tasks_pagination(self): # keyset pages cover every task once, in order
+        for number in range(5):
+            db.session.add(Task(task_name=f'Paged Task {number}', task_tag='DIY', task_status='New'))
+        db.session.commit()
+        seen = []
+        cursor = None
+        while True:
+            tasks, cursor = get_tasks_page(cursor=cursor, limit=2, sort='id', tag='DIY')
+            seen.extend(task.task_name for task in tasks)
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f'Paged Task {number}' for number in range(5)])
+        response = self.client.get(url_for('overview_tasks', limit=2, tag='DIY', sort='id'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Next page', response.data) # link to the following page
+
+    def test_overview_tasks_streamed(self): # all=1 streams every task in one response
+        for number in range(5):
+            db.session.add(Task(task_name=f'Streamed Task {number}', task_tag='DIY', task_status='New'))
+        db.session.commit()
+        response = self.client.get(url_for('overview_tasks', all=1, tag='DIY', limit=2))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed) # rendered while rows are read
+        for number in range(5):
+            self.assertIn(f'Streamed Task {number}'.encode(), response.data)
+        self.assertNotIn(b'Next page', response.data)
+
+    def test_due_date_queries(self): # due today / overdue / next N days helpers
+        now = datetime(2024, 8, 25, 12, 0)
+        db.session.add(Task(task_name='Due Later Today', task_status='New', task_due=datetime(2024, 8, 25, 20, 0)))
+        db.session.add(Task(task_name='Due In Three Days', task_status='In Progress', task_due=now + timedelta(days=3)))
+        db.session.add(Task(task_name='Done Yesterday', task_status='Completed', task_due=now - timedelta(days=1)))
+        db.session.add(Task(task_name='Missed', task_status='New', task_due=now - timedelta(days=2)))
+        db.session.commit()
+        self.assertEqual([task.task_name for task in get_tasks_due_today(now)], ['Test Task', 'Due Later Today'])
+        self.assertEqual([task.task_name for task in get_overdue_tasks(now)], ['Missed']) # completed tasks are not overdue
+        self.assertEqual([task.task_name for task in get_tasks_due_next(7, now)], ['Test Task', 'Due Later Today', 'Due In Three Days'])
+
+    def test_pool_stats_requires_login(self): # pool internals are only shown to logged-in users
+        response = self.client.get(url_for('pool_stats'))
+        self.assertEqual(response.status_code, 302)
+        with self.client.session_transaction() as sess:
+            sess['username'] = self.username
+        self.assertIn('pool', self.client.get(url_for('pool_stats')).json)
+
     def test_overview_goals(self): # goals overview page response test
         with self.client as client: # simulate user login
             with client.session_transaction() as sess:
@@ -96,6 +148,37 @@ class TestApp(unittest.TestCase):
         self.assertIsNotNone(task) # checks task not None
         self.assertEqual(task.task_description, 'Test Task Description') # check description data match
 
+    def test_listing_cache_invalidation(self): # cached pages are reused until a write bumps the version
+        self.client.get(url_for('overview_tasks'))
+        hits = listings.stats()['hits']
+        db.session.add(Task(task_name='Written Directly', task_tag='home', task_status='New')) # bypasses the write paths
+        db.session.commit()
+        response = self.client.get(url_for('overview_tasks'))
+        self.assertEqual(listings.stats()['hits'], hits + 1) # served from the cache
+        self.assertNotIn(b'Written Directly', response.data)
+        self.client.post(url_for('add_task'), data={'name': 'Added Through Form', 'tag': 'home', 'due': '2024-08-26T09:00', 'status': 'New'})
+        response = self.client.get(url_for('overview_tasks'))
+        self.assertIn(b'Written Directly', response.data)
+        self.assertIn(b'Added Through Form', response.data)
+        self.assertIn(b'2024-08-25 18:00:00', response.data) # datetimes display the same from the cache
+
+    def test_overview_tasks_not_modified(self): # unchanged reloads get 304 without touching the database
+        response = self.client.get(url_for('overview_tasks'))
+        etag = response.headers['ETag']
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        lookups = listings.stats()['hits'] + listings.stats()['misses']
+        response = self.client.get(url_for('overview_tasks'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(listings.stats()['hits'] + listings.stats()['misses'], lookups) # no query, not even a cached one
+        response = self.client.get(url_for('overview_tasks', sort='id'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200) # other page, other ETag
+        self.client.post(url_for('add_task'), data={'name': 'New Task', 'tag': 'home', 'due': '2024-08-26T09:00', 'status': 'New'})
+        response = self.client.get(url_for('overview_tasks'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'New Task', response.data)
+        self.assertIsNotNone(response.last_modified)
+
     def test_add_goal(self): # add goal test
         with self.client as client:
             with client.session_transaction() as sess:
@@ -126,6 +209,85 @@ class TestApp(unittest.TestCase):
         self.assertEqual(updated_task.task_owner, 'Updated Task Owner') # checks owner data match
         self.assertEqual(updated_task.task_status, 'In Progress') # checks status data match
 
+    def test_complete_task_archives(self): # completing a task moves it to the archive
+        task_id = Task.query.first().task_id
+        response = self.client.post(url_for('update_task', task_id=task_id), data={
+            'description': 'Done',
+            'owner': 'Test Owner',
+            'status': 'Completed'
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNone(db.session.get(Task, task_id)) # removed from tasks
+        self.assertEqual(ArchivedTasks.query.filter_by(task_id=task_id).one().task_description, 'Done')
+
+    def test_archive_in_batches(self): # archiver only moves completed tasks, batch by batch
+        for number in range(5):
+            db.session.add(Task(task_name=f'Done {number}', task_status='Completed'))
+        db.session.commit()
+        result = archive_completed(batch_size=2)
+        self.assertEqual(result['rows'], 5)
+        self.assertEqual(result['batches'], 3)
+        self.assertEqual(Task.query.count(), 1) # the 'New' test task stays
+        self.assertEqual(ArchivedTasks.query.count(), 5)
+        self.assertEqual(archive_completed()['rows'], 0) # nothing new to move
+
+    def test_archive_reused_task_id(self): # a new task can get the id of an archived one and still be archived
+        task = Task(task_name='First', task_status='Completed')
+        db.session.add(task)
+        db.session.commit()
+        task_id = task.task_id
+        archive_completed()
+        db.session.add(Task(task_id=task_id, task_name='Second', task_status='Completed')) # id handed out again
+        db.session.commit()
+        self.assertEqual(archive_completed()['rows'], 1)
+        archived = ArchivedTasks.query.filter_by(task_id=task_id).order_by(ArchivedTasks.a_id).all()
+        self.assertEqual([row.task_name for row in archived], ['First', 'Second'])
+
+    def test_archive_pages_with_repeated_task_ids(self): # ties are broken on a_id, so no row is skipped
+        due = datetime(2024, 8, 1, 9, 0)
+        for number, task_id in enumerate([1, 1, 1, 2, 2]):
+            db.session.add(ArchivedTasks(task_id=task_id, task_name=f'Archived {number}', task_tag='DIY', task_due=due, task_status='Completed'))
+        db.session.commit()
+        for sort in ('due', 'id', 'status'):
+            seen = []
+            cursor = None
+            while True:
+                rows, cursor = get_archived_tasks_page(cursor=cursor, limit=2, sort=sort, tag='DIY')
+                seen.extend(row.task_name for row in rows)
+                if cursor is None:
+                    break
+            self.assertEqual(seen, [f'Archived {number}' for number in range(5)], sort)
+
+    def test_import_export_round_trip(self): # CSV import validates rows, export can be re-imported
+        source = io.StringIO(
+            'name,description,owner,tag,due,status\n'
+            'Imported Task,From CSV,,DIY,2024-09-01T10:00,New\n'
+            ',Missing name,,DIY,2024-09-01T10:00,New\n'
+            'Bad Tag,,,bogus,2024-09-01T10:00,New\n'
+        )
+        result = import_tasks(source, 'csv', chunk_size=1)
+        self.assertEqual(result['rows'], 1)
+        self.assertEqual(result['invalid'], 2)
+        self.assertEqual(Task.query.filter_by(task_name='Imported Task').first().task_due, datetime(2024, 9, 1, 10, 0))
+
+        exported = io.StringIO()
+        self.assertEqual(export_tasks(exported, fmt='jsonl')['rows'], 2)
+        exported.seek(0)
+        self.assertEqual(import_tasks(exported, 'jsonl')['rows'], 2)
+        self.assertEqual(Task.query.count(), 4)
+
+    def test_import_bad_json_lines(self): # a broken line is reported, the rest of the file still imported
+        source = io.StringIO(
+            '{"name": "Good", "tag": "DIY", "due": "2024-09-01T10:00", "status": "New"}\n'
+            '{"name": "Broken",\n'
+            '\n'
+            '["a"]\n'
+        )
+        result = import_tasks(source, 'jsonl')
+        self.assertEqual((result['rows'], result['invalid']), (1, 2))
+        self.assertEqual([error['line'] for error in result['errors']], [2, 4])
+        self.assertIn('row', result['errors'][1]['errors'])
+
     def test_update_goal(self): # update goal test
         with self.client as client:  # simulate user login
             with client.session_transaction() as sess:
@@ -144,7 +306,9 @@ class TestApp(unittest.TestCase):
         with self.client as client:  # simulate user login
             with client.session_transaction() as sess:
                 sess['username'] = self.username
-            task = Task.query.first()
+            task = Task(task_name='Unclaimed Task', task_tag='home', task_status='New') # only unowned tasks can be claimed
+            db.session.add(task)
+            db.session.commit()
             response = self.client.post(url_for('claim_task', task_id=task.task_id), data={ # posts new owner
                 'owner': 'Test User'
             }, follow_redirects=True)
@@ -153,6 +317,30 @@ class TestApp(unittest.TestCase):
             claimed_task = db.session.get(Task, task.task_id) # checks DB
             self.assertEqual(claimed_task.task_owner, 'Test User') # checks owner data match
 
+    def test_claim_owned_task(self): # a task that already has an owner keeps it
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess['username'] = self.username
+            task_id = Task.query.first().task_id # owned by 'Test Owner'
+            self.client.post(url_for('claim_task', task_id=task_id))
+            db.session.expire_all()
+            self.assertEqual(db.session.get(Task, task_id).task_owner, 'Test Owner')
+
+    def test_claim_tasks_bulk(self): # one statement claims every selected task that is still unowned
+        tasks = [Task(task_name=f'Bulk Task {number}', task_tag='pets', task_status='New') for number in range(3)]
+        db.session.add_all(tasks)
+        db.session.commit()
+        task_ids = [task.task_id for task in tasks] + [Task.query.filter_by(task_owner='Test Owner').first().task_id]
+        claim_tasks(task_ids[:1], 'Someone Else')
+        with self.client as client:
+            with client.session_transaction() as sess:
+                sess['username'] = self.username
+            response = self.client.post(url_for('claim_tasks_bulk'), data={'task_id': task_ids}, follow_redirects=True)
+            self.assertEqual(response.status_code, 200)
+        db.session.expire_all()
+        owners = [db.session.get(Task, task_id).task_owner for task_id in task_ids]
+        self.assertEqual(owners, ['Someone Else', self.username, self.username, 'Test Owner'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from cache import Cache, MemoryBackend, MISSING
+
+
+# Controllable clock so expiry can be tested without sleeping
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.backend = MemoryBackend(max_size=2, clock=self.clock)
+        self.cache = Cache(self.backend, ttl=10, namespace='test')
+
+    def test_entries_expire_after_ttl(self): # entry is served until its TTL passes
+        self.cache.set('a', 1)
+        self.clock.now = 9
+        self.assertEqual(self.cache.get('a'), 1)
+        self.clock.now = 10
+        self.assertIs(self.cache.get('a'), MISSING)
+
+    def test_least_recently_used_is_evicted(self): # size bound evicts the oldest unused entry
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a') # 'b' is now least recently used
+        self.cache.set('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIs(self.cache.get('b'), MISSING)
+        self.assertEqual(self.backend.evictions, 1)
+
+    def test_hit_and_miss_counters(self): # loader only runs on a miss
+        loads = []
+        for _ in range(3):
+            self.cache.get_or_set('a', lambda: loads.append(1) or 'value')
+        self.assertEqual(len(loads), 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_cached_none_is_a_hit(self): # None is a valid cached value
+        self.cache.set('a', None)
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_counter_starts_from_seed(self): # missing counters restart from the seed, never from 0
+        self.assertEqual(self.cache.incr('version', seed=100), 101)
+        self.assertEqual(self.cache.incr('version', seed=500), 102)
+        self.cache.delete('version')
+        self.assertEqual(self.cache.incr('version', seed=500), 501)
+        self.clock.now = 1000 # counters do not expire
+        self.assertEqual(self.cache.get('version'), 501)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import threading
+import unittest
+from cache import Cache, MemoryBackend
+from catalog import Catalog
+
+
+# Minimal stand-in for the spotipy client - counts upstream calls, optionally blocks or fails
+class FakeSpotify:
+    def __init__(self, slow_uris=(), failing_uris=()):
+        self.calls = 0
+        self.slow_uris = slow_uris
+        self.failing_uris = failing_uris
+        self.album_count = 120
+        self.release = threading.Event() # slow lookups wait for this
+        self._lock = threading.Lock()
+
+    def playlist(self, uri, fields=None):
+        with self._lock:
+            self.calls += 1
+            self.fields = fields
+        if uri in self.slow_uris:
+            self.release.wait(5)
+        if uri in self.failing_uris:
+            raise RuntimeError('upstream error')
+        return {'name': f'Playlist {uri}', 'external_urls': {'spotify': f'https://open.spotify.com/{uri}'}}
+
+    def artist_albums(self, uri, album_type='album', limit=20, offset=0): # paging object like Spotify's
+        with self._lock:
+            self.calls += 1
+        names = [f'Album {n}' for n in range(self.album_count)]
+        return {'items': [{'name': name, 'external_urls': {'spotify': name}, 'tracks': {}} for name in names[offset:offset + limit]],
+                'total': self.album_count, 'limit': limit, 'offset': offset}
+
+
+class TestCatalog(unittest.TestCase):
+
+    def make_catalog(self, client, deadline=2.0):
+        catalog = Catalog(client, Cache(MemoryBackend(), ttl=60), max_workers=4, deadline=deadline)
+        self.addCleanup(catalog.executor.shutdown, wait=False)
+        return catalog
+
+    def test_repeat_lookups_skip_spotify(self): # second view served from cache
+        client = FakeSpotify()
+        catalog = self.make_catalog(client)
+        first = catalog.playlist_metadata('spotify:playlist:1')
+        second = catalog.playlist_metadata('spotify:playlist:1')
+        self.assertEqual(first, second)
+        self.assertEqual(client.calls, 1)
+
+    def test_playlist_fetch_is_field_projected(self): # only the rendered fields are requested
+        client = FakeSpotify()
+        self.make_catalog(client).playlists(['spotify:playlist:1'])
+        self.assertEqual(client.fields, 'name,external_urls.spotify')
+
+    def test_albums_trimmed_before_caching(self): # unused album fields are dropped
+        albums = self.make_catalog(FakeSpotify()).artist_albums('spotify:artist:1')
+        self.assertEqual(albums[0], {'name': 'Album 0', 'external_urls': {'spotify': 'Album 0'}})
+
+    def test_album_pages_fetched_and_cached_together(self): # every page merged in order, one cache entry
+        client = FakeSpotify()
+        catalog = self.make_catalog(client)
+        albums = catalog.artist_albums('spotify:artist:1')
+        catalog.artist_albums('spotify:artist:1')
+        self.assertEqual([album['name'] for album in albums], [f'Album {n}' for n in range(120)])
+        self.assertEqual(client.calls, 3) # 3 pages of 50, second lookup served from cache
+
+    def test_single_page_needs_one_call(self): # no extra requests when everything fits on the first page
+        client = FakeSpotify()
+        client.album_count = 7
+        albums = self.make_catalog(client).artist_albums('spotify:artist:1')
+        self.assertEqual(len(albums), 7)
+        self.assertEqual(client.calls, 1)
+
+    def test_playlists_keep_order(self): # concurrent fetches come back in the requested order
+        catalog = self.make_catalog(FakeSpotify())
+        uris = ['spotify:playlist:a', 'spotify:playlist:b', 'spotify:playlist:c']
+        names = [playlist['name'] for playlist in catalog.playlists(uris)]
+        self.assertEqual(names, [f'Playlist {uri}' for uri in uris])
+
+    def test_slow_playlist_degrades_at_deadline(self): # late playlist is None, the rest still render
+        client = FakeSpotify(slow_uris=('spotify:playlist:slow',))
+        catalog = self.make_catalog(client, deadline=0.05)
+        results = catalog.playlists(['spotify:playlist:fast', 'spotify:playlist:slow'])
+        self.assertEqual(results[0]['name'], 'Playlist spotify:playlist:fast')
+        self.assertIsNone(results[1])
+
+        client.release.set() # late result still fills the cache for the next view
+        catalog.executor.shutdown(wait=True)
+        self.assertIsNotNone(catalog.playlists(['spotify:playlist:slow'])[0])
+
+    def test_failed_playlist_degrades(self): # upstream error only affects its own entry
+        catalog = self.make_catalog(FakeSpotify(failing_uris=('spotify:playlist:bad',)))
+        results = catalog.playlists(['spotify:playlist:bad', 'spotify:playlist:good'])
+        self.assertIsNone(results[0])
+        self.assertIsNotNone(results[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import threading
+import unittest
+from werkzeug.security import generate_password_hash
+from hashing import PasswordHasher, HashingBusy
+
+
+class TestPasswordHasher(unittest.TestCase):
+
+    def setUp(self):
+        self.hasher = PasswordHasher(method='pbkdf2:sha256:1000', max_workers=1, max_queue=1, timeout=5)
+
+    def tearDown(self):
+        self.hasher.executor.shutdown(wait=True)
+
+    def test_hash_and_check(self):
+        stored = self.hasher.hash('secret')
+        self.assertTrue(stored.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(self.hasher.check(stored, 'secret'))
+        self.assertFalse(self.hasher.check(stored, 'wrong'))
+        stats = self.hasher.stats.as_dict()
+        self.assertEqual(stats['hash']['count'], 1)
+        self.assertEqual(stats['check']['count'], 2)
+
+    def test_needs_rehash(self):
+        self.assertFalse(self.hasher.needs_rehash(generate_password_hash('secret', 'pbkdf2:sha256:1000')))
+        self.assertTrue(self.hasher.needs_rehash(generate_password_hash('secret', 'pbkdf2:sha256:2000')))
+        self.assertTrue(self.hasher.needs_rehash(generate_password_hash('secret', 'scrypt')))
+
+    def test_busy_when_pool_is_full(self):
+        release = threading.Event()
+        started = threading.Event()
+        def slow(*args):
+            started.set()
+            release.wait(5)
+        self.hasher.executor.submit(lambda: None).result() # start the worker thread
+        threads = [threading.Thread(target=self.hasher._run, args=('hash', slow)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        while self.hasher.slots._value: # both slots (1 worker + 1 queued) taken
+            pass
+        with self.assertRaises(HashingBusy):
+            self.hasher.hash('secret')
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.hasher.stats.rejected, 1)
+        self.assertTrue(self.hasher.check(self.hasher.hash('secret'), 'secret')) # slots released
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
 import unittest
+from unittest import mock
+from werkzeug.security import generate_password_hash
 from app import app, db
 from models import User
+from hashing import hasher, HashingBusy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 from flask import url_for
@@ -102,6 +105,32 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.location, '/app')
 
 
+    def test_login_upgrades_old_password_hash(self):
+        #Test that a password stored with an older hash method is re-hashed on login
+        with self.app.app_context():
+            user = User(username='testuser7', name='Test User7', password=generate_password_hash('testpassword7', 'pbkdf2:sha256:1000'))
+            db.session.add(user)
+            db.session.commit()
+
+        response = self.client.post(url_for('login'), data=dict(username='testuser7', password='testpassword7'))
+        self.assertEqual(response.status_code, 302)
+
+        with self.app.app_context():
+            user = User.query.filter_by(username='testuser7').first()
+            self.assertFalse(hasher.needs_rehash(user.password))
+            self.assertTrue(user.check_password('testpassword7'))
+
+    def test_login_busy(self):
+        #Test that login fails fast when the hashing pool is full
+        with mock.patch.object(hasher, 'check', side_effect=HashingBusy):
+            with self.app.app_context():
+                user = User(username='testuser8', name='Test User8')
+                user.set_password('testpassword8')
+                db.session.add(user)
+                db.session.commit()
+            response = self.client.post(url_for('login'), data=dict(username='testuser8', password='testpassword8'))
+        self.assertEqual(response.status_code, 503)
+
     def test_logout(self):
         #Test that users can log out
         with self.app.app_context():
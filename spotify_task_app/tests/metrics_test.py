@@ -0,0 +1,79 @@
+import unittest
+import time
+from flask import Flask, render_template_string, stream_with_context
+from sqlalchemy import create_engine, text
+import metrics
+from benchmarks.fake_spotify import FakeSpotify
+
+
+class TestMetrics(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fake = FakeSpotify(latency=0.01).start()
+        cls.engine = create_engine('sqlite://')
+        cls.spotify = metrics.TimedSpotify(auth='test-token')
+        cls.spotify.prefix = cls.fake.url
+
+        app = Flask(__name__)
+        app.config['SLOW_REQUEST_SECONDS'] = 0.005
+        metrics.init_app(app)
+
+        @app.route('/breakdown')
+        def breakdown():
+            with cls.engine.connect() as connection:
+                connection.execute(text('select 1'))
+                connection.execute(text('select 2'))
+            playlist = cls.spotify.playlist('breakdown')
+            return render_template_string('<p>{{ name }}</p>', name=playlist['name'])
+
+        @app.route('/streamed')
+        def streamed():
+            def rows(): # each row takes a while, like rows read while the page streams
+                for number in range(3):
+                    time.sleep(0.01)
+                    yield number
+            stream = app.jinja_env.from_string('{% for row in rows %}<p>{{ row }}</p>{% endfor %}').stream(rows=rows())
+            return app.response_class(stream_with_context(metrics.timed_stream(stream)))
+
+        cls.client = app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+
+    def test_histogram_exposition(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', buckets=(0.1, 1.0), labels=('endpoint',))
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.1, 'a')
+        histogram.observe(5, 'a')
+        self.assertEqual(histogram.samples(), [
+            ('test_seconds_bucket', '{endpoint="a",le="0.1"}', 2),
+            ('test_seconds_bucket', '{endpoint="a",le="1.0"}', 2),
+            ('test_seconds_bucket', '{endpoint="a",le="+Inf"}', 3),
+            ('test_seconds_sum', '{endpoint="a"}', 5.15),
+            ('test_seconds_count', '{endpoint="a"}', 3)
+        ])
+
+    def test_request_breakdown(self):
+        with self.assertLogs('metrics', 'WARNING') as logs: # Spotify latency makes it a slow request
+            response = self.client.get('/breakdown')
+        self.assertEqual(response.data, b'<p>Playlist breakdown</p>')
+        self.assertIn('sql 2', logs.output[0])
+        self.assertIn('spotify 1', logs.output[0])
+        exposed = metrics.expose()
+        self.assertIn('http_requests_total{endpoint="breakdown",status="200"}', exposed)
+        self.assertIn('http_request_sql_queries_sum{endpoint="breakdown"} 2.0', exposed)
+        self.assertIn('http_request_spotify_calls_sum{endpoint="breakdown"} 1.0', exposed)
+        self.assertIn('http_request_render_seconds_count{endpoint="breakdown"} 1.0', exposed)
+
+    def test_streamed_render_time(self): # a streamed page fires no render signals, its chunks are timed instead
+        response = self.client.get('/streamed')
+        self.assertEqual(response.data, b'<p>0</p><p>1</p><p>2</p>')
+        render_sum = dict((labels, value) for name, labels, value in metrics.REQUEST_RENDER_SECONDS.samples()
+                          if name.endswith('_sum'))['{endpoint="streamed"}']
+        self.assertGreaterEqual(render_sum, 0.03)
+
+
+if __name__ == '__main__':
+    unittest.main()
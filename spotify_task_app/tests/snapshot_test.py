@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from cache import Cache, MemoryBackend
+from catalog import Catalog, CATEGORIES, is_artist
+import snapshot
+
+
+# Spotify client stand-in - answers like Spotify, or fails every call when down (an outage)
+class FakeSpotify:
+    def __init__(self):
+        self.calls = 0
+        self.down = False
+
+    def _call(self):
+        self.calls += 1
+        if self.down:
+            raise RuntimeError('Spotify is down')
+
+    def playlist(self, uri, fields=None):
+        self._call()
+        return {'name': f'Playlist {uri}', 'external_urls': {'spotify': f'https://open.spotify.com/{uri}'}}
+
+    def artist_albums(self, uri, album_type='album', limit=20, offset=0):
+        self._call()
+        return {'items': [{'name': f'Album {n}', 'external_urls': {'spotify': f'{uri}/{n}'}} for n in range(3)],
+                'total': 3, 'limit': limit, 'offset': offset}
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'catalog.json')
+        self.client = FakeSpotify()
+
+    def make_catalog(self, snapshot=None):
+        catalog = Catalog(self.client, Cache(MemoryBackend()), max_workers=4, snapshot=snapshot)
+        self.addCleanup(catalog.executor.shutdown, wait=False)
+        return catalog
+
+    def write_snapshot(self):
+        data, missing = snapshot.build(self.make_catalog())
+        self.assertEqual(missing, [])
+        snapshot.write(self.path, data)
+        return data
+
+    def test_build_covers_every_category(self):
+        data = self.write_snapshot()
+        uris = {uri for uris in CATEGORIES.values() for uri in uris if not is_artist(uri)}
+        self.assertEqual(set(data['playlists']), uris)
+        self.assertEqual(len(data['albums']), 2)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['catalog.json']) # no temporary file left behind
+
+    def test_served_without_spotify(self): # every category resolves from memory, even during an outage
+        self.write_snapshot()
+        self.client.calls = 0
+        self.client.down = True
+        catalog = self.make_catalog(snapshot.Snapshot(self.path))
+        for uris in CATEGORIES.values():
+            for uri in uris:
+                if is_artist(uri):
+                    self.assertEqual(len(catalog.artist_albums(uri)), 3)
+                else:
+                    self.assertIsNotNone(catalog.playlists([uri])[0])
+        self.assertEqual(self.client.calls, 0)
+
+    def test_newer_file_swapped_in(self):
+        self.write_snapshot()
+        now = [0.0]
+        served = snapshot.Snapshot(self.path, check_interval=5, clock=lambda: now[0])
+        uri = CATEGORIES['shopping'][0]
+        data = snapshot.load(self.path)
+        data['playlists'][uri] = {'name': 'Renamed', 'external_urls': {'spotify': 'https://open.spotify.com/renamed'}}
+        snapshot.write(self.path, data)
+        os.utime(self.path, ns=(0, 1)) # a different modification time, however fast the test runs
+
+        self.assertEqual(served.playlist(uri)['name'], f'Playlist {uri}') # not checked again yet
+        now[0] = 10.0
+        self.assertEqual(served.playlist(uri)['name'], 'Renamed')
+        self.assertEqual(served.stats()['loads'], 2)
+
+    def test_missing_file_falls_back_to_spotify(self):
+        with self.assertLogs('snapshot', 'ERROR'):
+            served = snapshot.Snapshot(self.path)
+        catalog = self.make_catalog(served)
+        self.assertIsNotNone(catalog.playlists(CATEGORIES['pets'])[0])
+        self.assertEqual(self.client.calls, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
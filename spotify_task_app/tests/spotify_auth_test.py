@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+from flask import Flask
+from cache import MemoryBackend
+from spotify_auth import TokenRefresher, spotify_login_required
+
+SCOPE = 'playlist-read-private playlist-read-collaborative'
+
+
+# Stands in for SpotifyOAuth.refresh_access_token - counts upstream refreshes
+class FakeOAuth:
+    def __init__(self, delay=0.05, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.scope = SCOPE
+
+    def refresh_access_token(self, refresh_token):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('refresh failed')
+        return {'access_token': f'new-{self.calls}', 'refresh_token': refresh_token, 'scope': SCOPE,
+                'expires_in': 3600, 'expires_at': int(time.time()) + 3600}
+
+
+def token(expires_in, refresh_token='refresh-1'):
+    return {'access_token': 'old', 'refresh_token': refresh_token, 'scope': SCOPE, 'expires_at': int(time.time()) + expires_in}
+
+
+class TestTokenRefresher(unittest.TestCase):
+
+    def setUp(self):
+        self.refresher = TokenRefresher('id', 'secret', 'http://localhost:5003/callback', SCOPE, MemoryBackend(), margin=300)
+        self.oauth = self.refresher.oauth = FakeOAuth()
+
+    def test_fresh_token_needs_no_refresh(self):
+        session = {'token_info': token(3600)}
+        self.assertTrue(self.refresher.ensure_fresh(session))
+        self.assertEqual(self.oauth.calls, 0)
+
+    def test_missing_token_or_scope(self):
+        self.assertFalse(self.refresher.ensure_fresh({}))
+        session = {'token_info': dict(token(3600), scope='user-read-email')}
+        self.assertFalse(self.refresher.ensure_fresh(session))
+
+    def test_refresh_in_background_and_pick_up(self): # near expiry - request continues, next request gets the new token
+        sessions = [{'token_info': token(120)} for _ in range(5)] # same refresh token, e.g. several tabs
+        threads = [threading.Thread(target=self.refresher.ensure_fresh, args=(session,)) for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([session['token_info']['access_token'] for session in sessions], ['old'] * 5)
+        self.refresher.refresh_async('refresh-1').result() # wait for the background refresh
+        self.assertEqual(self.oauth.calls, 1) # coalesced into one upstream call
+        self.assertTrue(self.refresher.ensure_fresh(sessions[0]))
+        self.assertEqual(sessions[0]['token_info']['access_token'], 'new-1')
+
+    def test_expired_token_waits_for_refresh(self):
+        session = {'token_info': token(-10)}
+        self.assertTrue(self.refresher.ensure_fresh(session))
+        self.assertEqual(session['token_info']['access_token'], 'new-1')
+
+    def test_failed_refresh_needs_authorisation(self):
+        self.oauth.fail = True
+        with self.assertLogs('spotify_auth', 'WARNING'):
+            self.assertFalse(self.refresher.ensure_fresh({'token_info': token(-10)}))
+        self.assertEqual(self.refresher.stats()['failures'], 1)
+
+    def test_offline_pages_need_no_token(self): # served from the snapshot, the token is not looked at
+        app = Flask(__name__)
+        app.secret_key = 'test'
+        login_required = spotify_login_required(self.refresher, lambda: 'https://accounts.spotify.com/authorize',
+                                                offline=lambda category: category == 'pets')
+
+        @app.route('/login')
+        def login():
+            return 'login'
+
+        @app.route('/<category>')
+        @login_required
+        def page(category):
+            return category
+
+        self.oauth.fail = True # Spotify is down
+        client = app.test_client()
+        self.assertEqual(client.get('/pets').headers['Location'], '/login') # the app login is still required
+        with client.session_transaction() as sess:
+            sess['username'] = 'Test User'
+        self.assertEqual(client.get('/pets').status_code, 200)
+        response = client.get('/cleaning')
+        self.assertTrue(response.headers['Location'].startswith('https://accounts.spotify.com')) # no token - authorise with Spotify
+        with client.session_transaction() as sess:
+            sess['token_info'] = token(-10)
+        self.assertEqual(client.get('/pets').status_code, 200)
+        self.assertEqual(self.oauth.calls, 0) # no refresh attempted
+
+
+if __name__ == '__main__':
+    unittest.main()
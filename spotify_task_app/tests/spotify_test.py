@@ -1,6 +1,7 @@
 import unittest
+from unittest import mock
 from flask import session
-from app import app, sp_oauth, cache_handler
+from app import app, sp_oauth, cache_handler, token_refresher
 
 
 class FlaskAppTestCase(unittest.TestCase):
@@ -16,6 +17,13 @@ class FlaskAppTestCase(unittest.TestCase):
             response = client.get('/spotify')
             self.assertEqual(response.status_code, 302)  # Expecting a redirect
 
+    def test_spotify_home_error_page(self):
+        """Test that /spotify shows the error page when Spotify cannot be reached"""
+        with mock.patch.object(token_refresher, 'ensure_fresh', side_effect=ConnectionError('Spotify is down')):
+            response = self.client.get('/spotify')
+        self.assertEqual(response.status_code, 500)
+        self.assertIn(b'Something went wrong', response.data)
+
     def test_home_page_redirects(self):
         """Test that /home-page redirects to the Spotify authorization page if not logged in"""
         with self.client as client:
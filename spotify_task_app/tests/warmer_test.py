@@ -0,0 +1,126 @@
+import threading
+import time
+import unittest
+from cache import Cache, MemoryBackend
+from catalog import Catalog
+from warmer import CatalogWarmer
+
+PLAYLIST = 'spotify:playlist:1'
+ARTIST = 'spotify:artist:1'
+
+
+# Spotify client stand-in - counts calls, can be slowed down (held until released) or fail
+class FakeSpotify:
+    def __init__(self):
+        self.calls = 0
+        self.version = 1 # changes what is returned, to tell refreshed data from old
+        self.fail = False
+        self.hold = threading.Event()
+        self.hold.set()
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        self.hold.wait(5)
+        if self.fail:
+            raise RuntimeError('upstream error')
+
+    def playlist(self, uri, fields=None):
+        self._call()
+        return {'name': f'{uri} v{self.version}', 'external_urls': {'spotify': uri}}
+
+    def artist_albums(self, uri, album_type='album', limit=20, offset=0):
+        self._call()
+        return {'items': [{'name': f'Album v{self.version}', 'external_urls': {'spotify': uri}}], 'total': 1, 'limit': limit, 'offset': offset}
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [1000.0]
+        self.client = FakeSpotify()
+        self.catalog = Catalog(self.client, Cache(MemoryBackend(), ttl=60), max_workers=4, clock=lambda: self.now[0])
+        self.addCleanup(self.catalog.executor.shutdown, wait=False)
+        self.addCleanup(self.catalog.refresh_executor.shutdown, wait=False)
+
+    def wait_for_refreshes(self):
+        deadline = time.monotonic() + 5
+        while self.catalog.stats()['in_flight'] and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    def test_stale_entry_served_while_one_refresh_runs(self):
+        self.catalog.playlist_metadata(PLAYLIST)
+        self.now[0] += 61 # gone stale
+        self.client.version = 2
+        self.client.hold.clear() # the refresh stays in flight
+        names = [self.catalog.playlist_metadata(PLAYLIST)['name'] for _ in range(5)]
+        self.assertEqual(names, [f'{PLAYLIST} v1'] * 5) # answered straight away with the stale entry
+        self.assertEqual(self.catalog.stats()['in_flight'], 1)
+        self.client.hold.set()
+        self.wait_for_refreshes()
+        self.assertEqual(self.client.calls, 2) # one load, one refresh
+        self.assertEqual(self.catalog.playlist_metadata(PLAYLIST)['name'], f'{PLAYLIST} v2')
+        self.assertEqual(self.catalog.stats()['stale_served'], 5)
+
+    def test_failed_refresh_keeps_stale_entry(self):
+        self.catalog.artist_albums(ARTIST)
+        self.now[0] += 61
+        self.client.fail = True
+        with self.assertLogs('catalog', 'WARNING'):
+            self.catalog.artist_albums(ARTIST)
+            self.wait_for_refreshes()
+        self.assertEqual(self.catalog.artist_albums(ARTIST)[0]['name'], 'Album v1')
+        self.assertEqual(self.catalog.stats()['refresh_failures'], 1)
+
+    def test_missing_entry_loaded_once(self): # concurrent first views share one upstream load
+        self.client.hold.clear()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.catalog.artist_albums(ARTIST))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        self.client.hold.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8)
+        self.assertEqual(self.client.calls, 1)
+
+
+class TestCatalogWarmer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [1000.0]
+        self.client = FakeSpotify()
+        self.catalog = Catalog(self.client, Cache(MemoryBackend(), ttl=600), clock=lambda: self.now[0])
+        self.addCleanup(self.catalog.executor.shutdown, wait=False)
+        self.warmer = CatalogWarmer(self.catalog, lead=60, jitter=30, clock=lambda: self.now[0])
+
+    def test_sweep_loads_missing_and_skips_fresh(self):
+        self.assertEqual(self.warmer.sweep([PLAYLIST, ARTIST, PLAYLIST]), 2)
+        self.assertEqual(self.warmer.sweep([PLAYLIST, ARTIST]), 0) # still fresh, not due yet
+        calls = self.client.calls
+        self.catalog.playlist_metadata(PLAYLIST) # pages find the data warm
+        self.assertEqual(self.client.calls, calls)
+
+    def test_refreshed_before_going_stale(self):
+        self.warmer.sweep([PLAYLIST])
+        self.now[0] += 600 - 60 # lead seconds before going stale - due whatever the jitter drew
+        self.client.version = 2
+        self.assertEqual(self.warmer.sweep([PLAYLIST]), 1)
+        self.assertEqual(self.warmer.stats()['lag_seconds'], 0.0)
+        self.assertEqual(self.catalog.playlist_metadata(PLAYLIST)['name'], f'{PLAYLIST} v2')
+
+    def test_lag_and_failures_reported(self):
+        self.warmer.sweep([PLAYLIST])
+        self.now[0] += 700 # 100 seconds stale
+        self.client.fail = True
+        with self.assertLogs('warmer', 'WARNING'):
+            self.warmer.sweep([PLAYLIST])
+        stats = self.warmer.stats()
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(stats['lag_seconds'], 100.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
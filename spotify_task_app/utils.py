@@ -1,21 +1,240 @@
+import base64
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, or_, and_
 from models import db, User, Task, ArchivedTasks
+from hashing import hasher, HashingBusy
+import task_stats
+
+PAGE_SIZE = 25 # default rows per overview page
+MAX_PAGE_SIZE = 200
+SORT_KEYS = ('due', 'id', 'status') # supported sort orders for task listings
+TASK_STATUSES = ('New', 'In Progress', 'Completed') # order used when sorting by status
+OPEN_STATUSES = ('New', 'In Progress') # statuses that still count as due
 
 
 # Function to return all tasks from Task table
 def get_all_tasks():
     return Task.query.all()
 
-# Function to return all archived tasks from ArchivedTasks table
-def get_archived_tasks():
-    return ArchivedTasks.query.all()
+# Function to return archived tasks from ArchivedTasks table - one month (YYYY-MM) only reads that month's partition/index range
+def get_archived_tasks(month=None):
+    return ArchivedTasks.query.filter(*archived_in(month)).all()
+
+# Function to turn a month ('2024-08') into its [start, end) datetimes - None if it is not a valid month
+def month_range(month):
+    try:
+        start = datetime.strptime(month, '%Y-%m')
+    except (TypeError, ValueError):
+        return None
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+# Function to return the conditions selecting archived tasks of one month (none for month=None) - a range
+# on archived_at, so MySQL only reads that month's partition and other backends one range of its index
+def archived_in(month):
+    period = month_range(month) if month else None
+    if period is None:
+        return ()
+    return ArchivedTasks.archived_at >= period[0], ArchivedTasks.archived_at < period[1]
+
+# Function to turn the sort values of the last row on a page into an opaque cursor string
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+# Function to read a cursor back - invalid or tampered cursors start from the first page
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) and len(values) == 2 else None
+
+# Function to apply the tag/owner/status filters shared by the task listings
+def filter_tasks(stmt, model, tag=None, owner=None, status=None):
+    if tag:
+        stmt = stmt.where(model.task_tag == tag)
+    if owner:
+        stmt = stmt.where(model.task_owner == owner)
+    if status:
+        stmt = stmt.where(model.task_status == status)
+    return stmt
+
+# Function to return the column breaking ties between rows with the same sort value - task ids can
+# repeat in the archive (an id handed out again after its task was archived), so it uses its own a_id
+def row_key(model):
+    return model.a_id if model is ArchivedTasks else model.task_id
+
+# Function to return one page of a task table using keyset (cursor) pagination.
+# Each page continues from the sort values of the previous page's last row, so every query is
+# an index range scan of limit rows regardless of table size (no OFFSET, no full scans).
+# With columns, only those columns are read and rows are plain tuples instead of ORM objects
+# (the columns must include the row key - see row_key - and the sort column). conditions are added to the filters.
+# Returns (rows, next_cursor) - next_cursor is None on the last page
+def get_tasks_page(model=Task, cursor=None, limit=PAGE_SIZE, sort='due', tag=None, owner=None, status=None, columns=None, conditions=()):
+    after = decode_cursor(cursor) if cursor else None
+    base = filter_tasks(select(*columns) if columns else select(model), model, tag, owner, status).where(*conditions)
+    key = row_key(model)
+
+    if sort == 'status':
+        rows = _status_page(model, base, after, limit + 1, status, entity=columns is None)
+    elif sort == 'id' and key is model.task_id:
+        stmt = base.order_by(model.task_id)
+        if after:
+            stmt = stmt.where(model.task_id > after[1])
+        rows = _fetch(stmt.limit(limit + 1), entity=columns is None)
+    elif sort == 'id': # archive - task id order, rows with the same task id in archiving order
+        stmt = base.order_by(model.task_id, key)
+        if after:
+            last_task_id, last_key = after
+            if isinstance(last_task_id, int):
+                stmt = stmt.where(or_(model.task_id > last_task_id, and_(model.task_id == last_task_id, key > last_key)))
+        rows = _fetch(stmt.limit(limit + 1), entity=columns is None)
+    else: # due date, ties broken by id; tasks without a due date come first
+        stmt = base.order_by(model.task_due, key)
+        if after:
+            due, last_id = after
+            try:
+                due = datetime.fromisoformat(due) if due else None
+            except (TypeError, ValueError): # tampered cursor - start from the first page
+                due, last_id = None, 0
+            if due is None:
+                stmt = stmt.where(or_(and_(model.task_due.is_(None), key > last_id), model.task_due.isnot(None)))
+            else:
+                stmt = stmt.where(or_(model.task_due > due, and_(model.task_due == due, key > last_id)))
+        rows = _fetch(stmt.limit(limit + 1), entity=columns is None)
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if sort == 'status':
+        sort_value = last.task_status
+    elif sort == 'id':
+        sort_value = None if key is model.task_id else last.task_id
+    else:
+        sort_value = last.task_due
+    return rows, encode_cursor([sort_value, getattr(last, key.key)])
+
+# Status order is walked one status at a time (each an index range on status + id), which keeps
+# the order the same on MySQL (ENUM index order) and other backends (string order)
+def _status_page(model, base, after, limit, status=None, entity=True):
+    statuses = [status] if status else list(TASK_STATUSES)
+    start = 0
+    if after and after[0] in statuses:
+        start = statuses.index(after[0])
+    else:
+        after = None
+    rows = []
+    for position in range(start, len(statuses)):
+        stmt = base.where(model.task_status == statuses[position]).order_by(row_key(model))
+        if after and position == start:
+            stmt = stmt.where(row_key(model) > after[1])
+        rows.extend(_fetch(stmt.limit(limit - len(rows)), entity))
+        if len(rows) >= limit:
+            break
+    return rows
+
+# Function to run a listing query - ORM objects for select(model), row tuples for selected columns
+def _fetch(stmt, entity=True):
+    result = db.session.execute(stmt)
+    return result.scalars().all() if entity else result.all()
+
+# Function to return one page of archived tasks - same options as get_tasks_page, plus month (YYYY-MM)
+def get_archived_tasks_page(month=None, **options):
+    return get_tasks_page(ArchivedTasks, conditions=archived_in(month), **options)
+
+# Function to iterate over every matching row of a task table in listing order without loading
+# them all - rows are fetched from a server-side cursor batch_size at a time (yield_per)
+def iter_tasks(model=Task, sort='due', tag=None, owner=None, status=None, batch_size=500, conditions=()):
+    base = filter_tasks(select(model), model, tag, owner, status).where(*conditions)
+    if sort == 'status':
+        statements = [base.where(model.task_status == value).order_by(row_key(model))
+                      for value in ([status] if status else TASK_STATUSES)]
+    elif sort == 'id':
+        statements = [base.order_by(model.task_id, row_key(model)) if model is ArchivedTasks else base.order_by(model.task_id)]
+    else:
+        statements = [base.order_by(model.task_due, row_key(model))]
+    for stmt in statements:
+        yield from db.session.execute(stmt.execution_options(yield_per=batch_size)).scalars()
+
+# Function to return open tasks due in [start, end) - served by the (status, due) index as one
+# range scan per open status
+def get_tasks_due_between(start, end):
+    return (Task.query
+            .filter(Task.task_status.in_(OPEN_STATUSES), Task.task_due >= start, Task.task_due < end)
+            .order_by(Task.task_due)
+            .all())
+
+# Function to return open tasks due at any time today
+def get_tasks_due_today(now=None):
+    today = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return get_tasks_due_between(today, today + timedelta(days=1))
+
+# Function to return open tasks whose due date has passed
+def get_overdue_tasks(now=None):
+    return (Task.query
+            .filter(Task.task_status.in_(OPEN_STATUSES), Task.task_due < (now or datetime.now()))
+            .order_by(Task.task_due)
+            .all())
+
+# Function to return open tasks due in the next days days
+def get_tasks_due_next(days, now=None):
+    now = now or datetime.now()
+    return get_tasks_due_between(now, now + timedelta(days=days))
+
+# Function to claim tasks for a user with one conditional UPDATE - a task is only claimed while it has
+# no owner, so when two users claim the same task at once exactly one of them wins.
+# The dashboard counts move with the claimed rows, which the UPDATE returns where the database supports
+# it (SQLite, PostgreSQL, MariaDB): a claim is then that one statement and the changed counts. MySQL reads
+# the claimed rows back grouped, in the same transaction.
+# Returns the number of tasks claimed (0 when every task was already owned or does not exist)
+def claim_tasks(task_ids, username):
+    if not task_ids:
+        return 0
+    unowned = or_(Task.task_owner.is_(None), Task.task_owner == '')
+    claim = (update(Task)
+             .where(Task.task_id.in_(task_ids), unowned)
+             .values(task_owner=username)
+             .execution_options(synchronize_session=False)) # no objects to refresh - the statement is the whole claim
+    if db.engine.dialect.update_returning:
+        rows = db.session.execute(claim.returning(Task.task_tag, Task.task_status, Task.task_due)).all()
+        claimed = len(rows)
+    else:
+        claimed = db.session.execute(claim).rowcount
+        rows = db.session.execute(
+            select(Task.task_tag, Task.task_status, Task.task_due, func.count().label('count'))
+            .where(Task.task_id.in_(task_ids), Task.task_owner == username)
+            .group_by(Task.task_tag, Task.task_status, Task.task_due)).all() if claimed else []
+        if sum(row.count for row in rows) != claimed: # the user already owned some of them - not told apart
+            db.session.rollback()
+            return _claim_locked(task_ids, username, unowned)
+    if not claimed:
+        db.session.rollback()
+        return 0
+    task_stats.claimed(rows, username)
+    db.session.commit()
+    return claimed
+
+# Function to claim tasks from their locked pre-image - for a claim whose claimed rows cannot be read back
+# apart from rows the user already owned (MySQL, a stale page)
+def _claim_locked(task_ids, username, unowned):
+    before = task_stats.locked(task_ids, unowned) # locks the claimable rows until the commit
+    if not before:
+        db.session.rollback()
+        return 0
+    result = db.session.execute(update(Task).where(Task.task_id.in_(list(before)), unowned).values(task_owner=username)
+                                .execution_options(synchronize_session=False))
+    task_stats.updated(before, {'task_owner': username})
+    db.session.commit()
+    return result.rowcount
 
 # Function to create a new user in the database
 def create_user(name, username, password):
     try:
         # Create a new user instance
         new_user = User(username=username, name=name)
-        # Hash the user's password
-        new_user.set_password(password)
+        # Hash the user's password on the hashing pool (raises HashingBusy when it is full)
+        new_user.password = hasher.hash(password)
         # Add the new user to the database session
         db.session.add(new_user)
         # Commit the transaction to save the user to the database
@@ -32,9 +251,26 @@ def login_user(username, password):
     #Find a user based on their unique username and authenticate it with their hashed password
     try:
         user = User.query.filter_by(username=username).first()
-        if user and user.check_password(password):
+        if user and hasher.check(user.password, password):
+            upgrade_password_hash(user, password)
             return True, 'Login has been successful!'
         return False, 'The credentials you have inputted are incorrect, please try again or contact customer support.'
+    except HashingBusy:
+        raise
     except Exception as e:
         print(f"Error during login: {e}")
         raise
+
+# Function to re-hash a password that was stored with an older method or cost, while the plain
+# password is known at login - stored hashes move to PASSWORD_HASH_METHOD without a password reset.
+# Best effort: if the hashing pool is busy the upgrade simply waits for a later login
+def upgrade_password_hash(user, password):
+    if not hasher.needs_rehash(user.password):
+        return False
+    try:
+        user.password = hasher.hash(password)
+        db.session.commit()
+    except HashingBusy:
+        return False
+    hasher.stats.record_rehash()
+    return True
@@ -0,0 +1,100 @@
+import logging
+import random
+import threading
+import time
+from catalog import is_artist
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = 30.0 # seconds between sweeps, varied by +-20%
+LEAD = 300.0 # seconds before an entry goes stale that it is refreshed
+JITTER = 120.0 # up to this many seconds earlier again, drawn per entry - spreads refreshes out over time and between processes
+
+
+# Keeps the catalog data of every registered category fresh, so no page view waits for Spotify.
+# Each sweep refreshes the entries that are missing or due; an entry is due lead seconds (plus its
+# own random jitter) before it goes stale. Refreshes run one at a time on the warmer's own thread
+# through Catalog.refresh, which shares any load of the same key already running for a page
+class CatalogWarmer:
+    def __init__(self, catalog, interval=INTERVAL, lead=LEAD, jitter=JITTER, clock=time.time):
+        self.catalog = catalog
+        self.interval = interval
+        self.lead = lead
+        self.jitter = jitter
+        self.clock = clock # injectable for tests
+        self.sweeps = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.lag_seconds = 0.0 # how long past going stale the latest sweep found its stalest entry
+        self.last_sweep = None
+        self._due = {} # uri -> (fresh_until, time its refresh is due)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _is_due(self, uri, fresh_until, now):
+        scheduled = self._due.get(uri)
+        if scheduled is None or scheduled[0] != fresh_until: # new data since the last draw
+            scheduled = (fresh_until, fresh_until - self.lead - random.uniform(0, self.jitter))
+            self._due[uri] = scheduled
+        return now >= scheduled[1]
+
+    # Function to refresh every entry of uris that is missing or due - returns the number refreshed
+    def sweep(self, uris):
+        now = self.clock()
+        lag = 0.0
+        refreshed = 0
+        for uri in dict.fromkeys(uris):
+            fresh_until = self.catalog.fresh_until(uri)
+            if fresh_until is None:
+                if self.catalog.snapshot is not None and self._in_snapshot(uri):
+                    continue
+            elif not self._is_due(uri, fresh_until, now):
+                continue
+            else:
+                lag = max(lag, now - fresh_until)
+            try:
+                self.catalog.refresh(uri)
+                refreshed += 1
+            except Exception as e: # left stale (still served) - tried again next sweep
+                self.failures += 1
+                logger.warning('Catalog warmer could not refresh %s: %s', uri, e)
+        self.refreshes += refreshed
+        self.lag_seconds = lag
+        self.last_sweep = now
+        self.sweeps += 1
+        return refreshed
+
+    def _in_snapshot(self, uri):
+        snapshot = self.catalog.snapshot
+        return (snapshot.albums(uri) if is_artist(uri) else snapshot.playlist(uri)) is not None
+
+    # Function to start the warmer once per process - a daemon thread sweeping the URIs returned by
+    # registry() (called inside an app context) every interval seconds. The first sweep comes after a
+    # random part of one interval, so worker processes started together do not sweep together
+    def start(self, app, registry):
+        if self._thread is not None or not self.interval: # checked on every request, so kept lock-free
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            def run():
+                time.sleep(random.uniform(0, self.interval))
+                while True:
+                    try:
+                        with app.app_context():
+                            uris = [uri for category_uris in registry().values() for uri in category_uris]
+                        self.sweep(uris)
+                    except Exception as e: # the warmer keeps running whatever happens in one sweep
+                        logger.error('Catalog warmer sweep failed: %s', e)
+                    time.sleep(self.interval * random.uniform(0.8, 1.2))
+            self._thread = threading.Thread(target=run, name='catalog-warmer', daemon=True)
+            self._thread.start()
+
+    def stats(self):
+        return {
+            'sweeps': self.sweeps,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'lag_seconds': self.lag_seconds,
+            'last_sweep_age_seconds': self.clock() - self.last_sweep if self.last_sweep is not None else None
+        }